@@ -2,6 +2,7 @@ CREATE TABLE Caregivers (
     Username varchar(255),
     Salt BINARY(16),
     Hash BINARY(16),
+    PasswordHash varchar(255),
     PRIMARY KEY (Username)
 );
 
@@ -9,12 +10,21 @@ CREATE TABLE Patients (
     Username varchar(255),
     Salt BINARY(16),
     Hash BINARY(16),
+    PasswordHash varchar(255),
     PRIMARY KEY (Username)
 );
 
+CREATE TABLE Vaccines (
+    Name varchar(255),
+    Doses int,
+    Version int NOT NULL DEFAULT 0,
+    PRIMARY KEY (Name)
+);
+
 CREATE TABLE Availabilities (
     Time date,
     Username varchar(255) REFERENCES Caregivers,
+    Slots int NOT NULL DEFAULT 1,
     PRIMARY KEY (Time, Username)
 );
 
@@ -24,11 +34,21 @@ CREATE TABLE Appointments (
     p_username varchar(255) REFERENCES Patients(Username),
     Time date,
     Name varchar(255) REFERENCES Vaccines(Name),
+    Slot int NOT NULL DEFAULT 0,
     PRIMARY KEY (AppID)
 );
 
-CREATE TABLE Vaccines (
+CREATE TABLE IdBlocks (
     Name varchar(255),
-    Doses int,
+    NextValue int,
     PRIMARY KEY (Name)
-);
\ No newline at end of file
+);
+
+CREATE TABLE Waitlist (
+    WaitID int,
+    p_username varchar(255) REFERENCES Patients(Username),
+    Time date,
+    Name varchar(255) REFERENCES Vaccines(Name),
+    PRIMARY KEY (WaitID),
+    UNIQUE (p_username, Time, Name)
+);
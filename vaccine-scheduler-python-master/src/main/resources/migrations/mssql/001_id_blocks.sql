@@ -0,0 +1,7 @@
+-- counters for the block id allocator (service/IdAllocator.py)
+IF OBJECT_ID('IdBlocks', 'U') IS NULL
+    CREATE TABLE IdBlocks (
+        Name varchar(255),
+        NextValue int,
+        PRIMARY KEY (Name)
+    );
@@ -0,0 +1,6 @@
+-- self-describing password hashes (util/PasswordHasher.py); Salt and Hash stay for legacy rows
+IF COL_LENGTH('Patients', 'PasswordHash') IS NULL
+    ALTER TABLE Patients ADD PasswordHash varchar(255);
+
+IF COL_LENGTH('Caregivers', 'PasswordHash') IS NULL
+    ALTER TABLE Caregivers ADD PasswordHash varchar(255);
@@ -0,0 +1,3 @@
+-- bumped on every dose change so caches can order updates (service/VaccineInventory.py)
+IF COL_LENGTH('Vaccines', 'Version') IS NULL
+    ALTER TABLE Vaccines ADD Version int NOT NULL DEFAULT 0;
@@ -0,0 +1,15 @@
+-- show_appointments: seek by user, rows already in AppID order, no lookups into the table
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Appointments_p_username')
+    CREATE INDEX IX_Appointments_p_username ON Appointments (p_username, AppID) INCLUDE (Name, Time, c_username);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Appointments_c_username')
+    CREATE INDEX IX_Appointments_c_username ON Appointments (c_username, AppID) INCLUDE (Name, Time, p_username);
+
+-- appointments by day, e.g. everything a caregiver has on a date
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Appointments_Time')
+    CREATE INDEX IX_Appointments_Time ON Appointments (Time, c_username);
+
+-- a caregiver's own availability, e.g. the duplicate check of upload_availability_range
+-- (lookups by date already seek on the (Time, Username) primary key)
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Availabilities_Username')
+    CREATE INDEX IX_Availabilities_Username ON Availabilities (Username, Time);
@@ -0,0 +1,8 @@
+-- free time slots of a caregiver's day as a bitmap, bit i set = slot i free (util/Slots.py);
+-- rows from before time slots are a day with one slot
+IF COL_LENGTH('Availabilities', 'Slots') IS NULL
+    ALTER TABLE Availabilities ADD Slots int NOT NULL DEFAULT 1;
+
+-- the slot an appointment holds, given back to Availabilities.Slots when it is cancelled
+IF COL_LENGTH('Appointments', 'Slot') IS NULL
+    ALTER TABLE Appointments ADD Slot int NOT NULL DEFAULT 0;
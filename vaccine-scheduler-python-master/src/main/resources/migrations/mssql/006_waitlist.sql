@@ -0,0 +1,20 @@
+-- reservations that failed for want of a caregiver or doses, booked in WaitID order
+-- once capacity arrives (service/WaitlistEngine.py); a patient is queued once per
+-- day and vaccine
+IF OBJECT_ID('Waitlist', 'U') IS NULL
+    CREATE TABLE Waitlist (
+        WaitID int,
+        p_username varchar(255) REFERENCES Patients(Username),
+        Time date,
+        Name varchar(255) REFERENCES Vaccines(Name),
+        PRIMARY KEY (WaitID),
+        UNIQUE (p_username, Time, Name)
+    );
+GO
+
+-- the waiting entries of the vaccines that got doses or the days that got slots, oldest first
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Waitlist_Name')
+    CREATE INDEX IX_Waitlist_Name ON Waitlist (Name, WaitID) INCLUDE (p_username, Time);
+
+IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = 'IX_Waitlist_Time')
+    CREATE INDEX IX_Waitlist_Time ON Waitlist (Time, WaitID) INCLUDE (p_username, Name);
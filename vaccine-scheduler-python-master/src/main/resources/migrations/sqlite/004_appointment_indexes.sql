@@ -0,0 +1,14 @@
+-- SQLite databases are always created from the current create.sql, so migrations
+-- 1-3 have no SQLite counterpart. SQLite has no INCLUDE, the covered columns are
+-- appended to the key instead.
+
+-- show_appointments: seek by user, rows already in AppID order, no lookups into the table
+CREATE INDEX IF NOT EXISTS IX_Appointments_p_username ON Appointments (p_username, AppID, Name, Time, c_username);
+
+CREATE INDEX IF NOT EXISTS IX_Appointments_c_username ON Appointments (c_username, AppID, Name, Time, p_username);
+
+-- appointments by day, e.g. everything a caregiver has on a date
+CREATE INDEX IF NOT EXISTS IX_Appointments_Time ON Appointments (Time, c_username);
+
+-- a caregiver's own availability, e.g. the duplicate check of upload_availability_range
+CREATE INDEX IF NOT EXISTS IX_Availabilities_Username ON Availabilities (Username, Time);
@@ -0,0 +1,7 @@
+-- free time slots of a caregiver's day as a bitmap, bit i set = slot i free (util/Slots.py);
+-- rows from before time slots are a day with one slot. Databases created from the
+-- current create.sql already have both columns, the Migrator skips them there.
+ALTER TABLE Availabilities ADD COLUMN Slots int NOT NULL DEFAULT 1;
+
+-- the slot an appointment holds, given back to Availabilities.Slots when it is cancelled
+ALTER TABLE Appointments ADD COLUMN Slot int NOT NULL DEFAULT 0;
@@ -0,0 +1,16 @@
+-- reservations that failed for want of a caregiver or doses, booked in WaitID order
+-- once capacity arrives (service/WaitlistEngine.py); a patient is queued once per
+-- day and vaccine
+CREATE TABLE IF NOT EXISTS Waitlist (
+    WaitID int,
+    p_username varchar(255) REFERENCES Patients(Username),
+    Time date,
+    Name varchar(255) REFERENCES Vaccines(Name),
+    PRIMARY KEY (WaitID),
+    UNIQUE (p_username, Time, Name)
+);
+
+-- the waiting entries of the vaccines that got doses or the days that got slots, oldest first
+CREATE INDEX IF NOT EXISTS IX_Waitlist_Name ON Waitlist (Name, WaitID, p_username, Time);
+
+CREATE INDEX IF NOT EXISTS IX_Waitlist_Time ON Waitlist (Time, WaitID, p_username, Name);
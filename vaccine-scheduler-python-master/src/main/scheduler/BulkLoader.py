@@ -0,0 +1,195 @@
+'''
+Bulk loader for onboarding patients, caregivers, vaccines and availabilities.
+
+Run from src/main/scheduler:
+    python BulkLoader.py patients patients.csv
+    python BulkLoader.py availabilities shifts.jsonl --batch-size 5000 --checkpoint shifts.ckpt
+
+Input is CSV with a header row or JSON lines, chosen by file extension (or --format):
+    patients, caregivers    username,password
+    vaccines                name,doses
+    availabilities          date,username      (date as mm-dd-yyyy or yyyy-mm-dd)
+
+Records are streamed and written in batches, one transaction per batch, so memory
+stays bounded by the batch size. Passwords are hashed in a process pool. Users and
+availabilities that already exist are skipped; vaccine doses are added to the
+existing stock. After every committed batch the number of records consumed is
+written to the checkpoint file, and a rerun with the same checkpoint resumes after it.
+A crash between a commit and its checkpoint replays that one batch: users and
+availabilities are skipped as duplicates, vaccine doses would be added twice.
+'''
+from util.PasswordHasher import PasswordHasher
+from db.ConnectionManager import ConnectionManager
+from db.Batch import chunks, insert_rows, select_existing
+from model.Patient import Patient
+from model.Caregiver import Caregiver
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import os
+import sys
+import time
+
+
+def read_records(path, fmt):
+    with open(path, newline="", encoding="utf-8") as f:
+        if fmt == "csv":
+            for record in csv.DictReader(f):
+                yield record
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def batched(records, size):
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def parse_date(value):
+    value = str(value).strip()
+    try:
+        return datetime.date.fromisoformat(value)
+    except ValueError:
+        month, day, year = value.split("-")
+        return datetime.date(int(year), int(month), int(day))
+
+
+def hash_credentials(record, scheme):
+    # runs in a worker process
+    return record["username"], PasswordHasher.hash_password(record["password"], scheme)
+
+
+class BulkLoader:
+    USER_MODELS = {"patients": Patient, "caregivers": Caregiver}
+
+    def __init__(self, kind, batch_size=1000, workers=None):
+        if kind not in ("patients", "caregivers", "vaccines", "availabilities"):
+            raise ValueError("Unknown record kind: " + kind)
+        if batch_size <= 0:
+            raise ValueError("Batch size must be positive!")
+        self.kind = kind
+        self.batch_size = batch_size
+        self.workers = workers or os.cpu_count()
+        self.pool = None
+
+    def load(self, records, skip=0, on_batch=None):
+        # on_batch(consumed, written) is called after every committed batch
+        records = itertools.islice(records, skip, None)
+        consumed = skip
+        written = 0
+        if self.kind in BulkLoader.USER_MODELS:
+            self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            for batch in batched(records, self.batch_size):
+                written += self.write_batch(batch)
+                consumed += len(batch)
+                if on_batch is not None:
+                    on_batch(consumed, written)
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+        return consumed, written
+
+    def write_batch(self, batch):
+        if self.kind in BulkLoader.USER_MODELS:
+            return self.write_users(batch)
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            if self.kind == "vaccines":
+                written = self.write_vaccines(cursor, batch)
+            else:
+                written = self.write_availabilities(cursor, batch)
+            conn.commit()
+        return written
+
+    def write_users(self, batch):
+        chunksize = max(1, len(batch) // (self.workers * 4))
+        schemes = itertools.repeat(PasswordHasher.current_scheme())
+        model = BulkLoader.USER_MODELS[self.kind]
+        users = [model(username, password_hash=password_hash) for username, password_hash
+                 in self.pool.map(hash_credentials, batch, schemes, chunksize=chunksize)]
+        return len(users) - len(model.save_all(users))
+
+    def write_vaccines(self, cursor, batch):
+        doses = {}
+        for record in batch:
+            count = int(record["doses"])
+            if count <= 0:
+                raise ValueError("Argument cannot be negative!")
+            doses[record["name"]] = doses.get(record["name"], 0) + count
+        existing = select_existing(cursor, "SELECT Name FROM Vaccines WHERE Name IN ({})", doses)
+        for name in existing:
+            cursor.execute("UPDATE Vaccines SET Doses = Doses + %d, Version = Version + 1 WHERE Name = %s",
+                           (doses[name], name))
+        new = [(name, count, 0) for name, count in doses.items() if name not in existing]
+        return len(existing) + insert_rows(cursor, "Vaccines", ("Name", "Doses", "Version"), new)
+
+    def write_availabilities(self, cursor, batch):
+        pairs = {(parse_date(record["date"]), record["username"]) for record in batch}
+        dates = [d for d, _ in pairs]
+        usernames = {username for _, username in pairs}
+        existing = set()
+        query = "SELECT Time, Username FROM Availabilities WHERE Time BETWEEN %s AND %s AND Username IN ({})"
+        for chunk in chunks(list(usernames), 1000):
+            cursor.execute(query.format(", ".join(["%s"] * len(chunk))), (min(dates), max(dates)) + tuple(chunk))
+            existing.update((row[0], row[1]) for row in cursor)
+        rows = sorted(pair for pair in pairs if pair not in existing)
+        return insert_rows(cursor, "Availabilities", ("Time", "Username"), rows)
+
+
+def read_checkpoint(path):
+    if path is None or not os.path.exists(path):
+        return 0
+    with open(path) as f:
+        return int(f.read().strip() or 0)
+
+
+def write_checkpoint(path, consumed):
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        f.write(str(consumed))
+    os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk load records into the scheduler database")
+    parser.add_argument("kind", choices=["patients", "caregivers", "vaccines", "availabilities"])
+    parser.add_argument("file")
+    parser.add_argument("--format", choices=["csv", "jsonl"])
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--workers", type=int, default=None, help="password hashing processes (default: cores)")
+    parser.add_argument("--checkpoint", help="file recording progress, used to resume an interrupted load")
+    args = parser.parse_args()
+
+    fmt = args.format or ("jsonl" if args.file.endswith((".jsonl", ".json")) else "csv")
+    skip = read_checkpoint(args.checkpoint)
+    if skip:
+        print(f"Resuming after {skip} records")
+
+    started = time.perf_counter()
+
+    def report(consumed, written):
+        if args.checkpoint:
+            write_checkpoint(args.checkpoint, consumed)
+        elapsed = time.perf_counter() - started
+        rate = (consumed - skip) / elapsed if elapsed > 0 else 0
+        print(f"{consumed} records read, {written} written, {rate:.0f} records/sec", file=sys.stderr)
+
+    loader = BulkLoader(args.kind, args.batch_size, args.workers)
+    consumed, written = loader.load(read_records(args.file, fmt), skip=skip, on_batch=report)
+    print(f"Loaded {args.kind}: {consumed} records read, {written} written "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+'''
+Serves the scheduler to many clients at once over a local socket.
+
+Run from src/main/scheduler:
+    python SchedulerServer.py --port 8765
+    python SchedulerServer.py --unix /tmp/scheduler.sock
+
+Clients send the same command lines as the command line application, one per
+line, and get back the same output followed by a "> " prompt (so `nc localhost
+8765` works as a terminal). Every connection is its own session with its own
+login, and `quit` or closing the connection ends it.
+
+One asyncio event loop owns all the sockets. Commands run in a thread pool
+(ServerWorkers threads, default 32) so database calls never block the loop,
+and passwords are hashed in HashService's worker processes.
+'''
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import Scheduler
+from service.SchedulerSession import CommandResult, SchedulerSession
+from util.Metrics import Metrics
+
+class Session:
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.session = SchedulerSession()
+
+    def run(self, tokens):
+        # runs in a worker thread, sessions hold their own login so they never interfere
+        try:
+            result = self.session.execute(tokens)
+        except SystemExit:
+            # raised when no database connection can be had, the session just ends
+            return CommandResult(False, ["Error occured. Try again!"], stop=True)
+        except Exception as e:
+            return CommandResult(False, ["Error occured. Try again!", "Error: " + str(e)])
+        if result.fatal:
+            # the command line application quits on database errors, a session just ends
+            result.stop = True
+        return result
+
+    def send(self, text):
+        self.writer.write(text.encode("utf-8"))
+
+
+class SchedulerServer:
+    def __init__(self, workers=32):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler")
+        menu = io.StringIO()
+        with contextlib.redirect_stdout(menu):
+            print("Welcome to the COVID-19 Vaccine Reservation Scheduling Application!")
+            Scheduler.print_menu()
+        self.welcome = menu.getvalue()
+
+    async def handle(self, reader, writer):
+        session = Session(reader, writer)
+        loop = asyncio.get_running_loop()
+        try:
+            session.send(self.welcome + "> ")
+            await writer.drain()
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                tokens = line.decode("utf-8", "replace").rstrip("\r\n").split(" ")
+                result = await loop.run_in_executor(self.executor, session.run, tokens)
+                session.send(result.text() if result.stop else result.text() + "> ")
+                await writer.drain()
+                if result.stop:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def serve(self, host=None, port=None, path=None):
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        for sock in server.sockets:
+            print("Listening on", sock.getsockname(), flush=True)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vaccine scheduler server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=int(os.getenv("ServerPort", "8765")))
+    parser.add_argument("--unix", help="listen on this unix socket instead of TCP")
+    args = parser.parse_args()
+
+    Metrics.get_instance()
+    server = SchedulerServer(int(os.getenv("ServerWorkers", "32")))
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
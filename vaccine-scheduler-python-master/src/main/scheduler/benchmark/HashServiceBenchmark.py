@@ -0,0 +1,63 @@
+'''
+Measures password verifications (logins) per second against the number of
+hashing worker processes.
+
+Run from src/main/scheduler:
+    python -m benchmark.HashServiceBenchmark --workers 0 1 2 4 8 --sessions 32
+
+Each of --sessions threads plays a client logging in repeatedly; workers=0
+hashes inline in the session threads, as the scheduler did before HashService.
+The hash scheme is taken from the same environment variables as the scheduler,
+e.g. HashIterations=10000 or HashAlgorithm=scrypt.
+'''
+import argparse
+import os
+import threading
+import time
+from util.HashService import HashService
+from util.PasswordHasher import PasswordHasher
+
+
+def run(service, sessions, logins_per_session):
+    encoded = PasswordHasher.hash_password("Benchmark1!", PasswordHasher.current_scheme())
+
+    def login():
+        for _ in range(logins_per_session):
+            if not service.verify_password("Benchmark1!", encoded):
+                raise AssertionError("Hash mismatch!")
+
+    threads = [threading.Thread(target=login) for _ in range(sessions)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sessions * logins_per_session / (time.perf_counter() - start)
+
+
+def main():
+    cores = os.cpu_count()
+    parser = argparse.ArgumentParser(description="Password hashing throughput benchmark")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted({0, 1, 2, max(1, cores // 2), cores}))
+    parser.add_argument("--sessions", type=int, default=2 * cores)
+    parser.add_argument("--logins", type=int, default=5, help="logins per session")
+    args = parser.parse_args()
+
+    encoded_warmup = PasswordHasher.hash_password("warmup", PasswordHasher.current_scheme())
+    print("{: >10}\t{: >12}".format("Workers", "Logins/sec"))
+    for workers in args.workers:
+        service = HashService(workers)
+        # start every worker before timing so process spawn cost is not measured; the
+        # pool spawns workers on demand, so it takes as many tasks in flight at once
+        warmup = [service.submit(PasswordHasher.verify_password, "warmup", encoded_warmup)
+                  for _ in range(max(1, workers))]
+        for future in warmup:
+            future.result()
+        rate = run(service, args.sessions, args.logins)
+        service.shutdown()
+        print("{: >10}\t{: >12.1f}".format(workers, rate))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+'''
+Measures appointment id allocation throughput with many concurrent workers.
+
+Run from src/main/scheduler:
+    python -m benchmark.IdAllocatorBenchmark --workers 1 4 16 64 --block-sizes 1 10 100
+
+By default blocks come from a simulated source that sleeps --latency-ms per
+reservation, standing in for one database round trip; pass --db to reserve
+blocks from the IdBlocks table of the configured database instead (its
+Benchmark counter row is deleted again after every run).
+A block size of 1 is equivalent to one database query per reservation.
+'''
+import argparse
+import threading
+import time
+from service.IdAllocator import IdAllocator
+
+
+class SimulatedBlockSource:
+    def __init__(self, latency):
+        self.latency = latency
+        self.next_value = 1
+        self.round_trips = 0
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        with self.lock:
+            time.sleep(self.latency)
+            start = self.next_value
+            self.next_value += size
+            self.round_trips += 1
+            return start
+
+
+def run(allocator, workers, ids_per_worker):
+    results = [None] * workers
+
+    def work(i):
+        results[i] = [allocator.next_id() for _ in range(ids_per_worker)]
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    allocated = [i for ids in results for i in ids]
+    if len(set(allocated)) != len(allocated):
+        raise AssertionError("Duplicate ids were allocated!")
+    return len(allocated) / elapsed
+
+
+def drop_counter(name):
+    from db.ConnectionManager import ConnectionManager
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM IdBlocks WHERE Name = %s", name)
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Appointment id allocation benchmark")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--block-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--ids", type=int, default=2000, help="ids allocated by each worker")
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--db", action="store_true", help="reserve blocks from the configured database")
+    args = parser.parse_args()
+
+    print("{: >10}\t{: >10}\t{: >14}\t{: >12}".format("Workers", "Block", "IDs/sec", "Round trips"))
+    for block_size in args.block_sizes:
+        for workers in args.workers:
+            if args.db:
+                from service.IdAllocator import DbBlockSource
+                source = DbBlockSource("Benchmark", "SELECT 1")
+            else:
+                source = SimulatedBlockSource(args.latency_ms / 1000)
+            allocator = IdAllocator(source, block_size)
+            try:
+                rate = run(allocator, workers, args.ids)
+            finally:
+                if args.db:
+                    drop_counter(source.name)
+            round_trips = getattr(source, "round_trips", "-")
+            print("{: >10}\t{: >10}\t{: >14.0f}\t{: >12}".format(workers, block_size, rate, round_trips))
+
+
+if __name__ == "__main__":
+    main()
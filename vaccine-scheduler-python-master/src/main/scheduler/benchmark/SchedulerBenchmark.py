@@ -0,0 +1,205 @@
+'''
+Benchmarks the scheduler commands against a freshly seeded local SQLite database.
+
+Run from src/main/scheduler:
+    python -m benchmark.SchedulerBenchmark --patients 1000 --caregivers 50 --days 30 \
+        --concurrency 8 --ops 500 --out results.json
+
+The database is seeded with the given number of patients, caregivers (each
+available on every day), vaccines and doses. Each command is then driven through
+a SchedulerSession, --ops times, from --concurrency worker processes,
+with one phase per command in this order:
+    create_patient, login_patient, add_doses, search_caregiver_schedule,
+    reserve, reserve_earliest, show_appointments, cancel
+Throughput, p50/p95/p99 latency in milliseconds and the number of calls that
+succeeded are written as JSON, together with the settings,
+so runs can be compared over time. Seeded passwords are hashed once and shared,
+and the hash scheme follows the usual environment variables (e.g. HashIterations).
+'''
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+PASSWORD = "Benchmark1!"
+START_DATE = datetime.date(2030, 1, 1)
+
+COMMANDS = ["create_patient", "login_patient", "add_doses", "search_caregiver_schedule",
+            "reserve", "reserve_earliest", "show_appointments", "cancel"]
+
+def format_date(day):
+    return day.strftime("%m-%d-%Y")
+
+
+def seed(path, args):
+    from db.Backend import SqliteBackend
+    from db.Batch import insert_rows
+    from db.ConnectionManager import ConnectionManager
+    from db.Migrator import Migrator
+    from util.PasswordHasher import PasswordHasher
+
+    ConnectionManager.use_backend(SqliteBackend(path))
+    migrator = Migrator()
+    migrator.create_schema()
+    migrator.migrate()
+
+    password_hash = PasswordHasher.hash_password(PASSWORD, PasswordHasher.current_scheme())
+    days = [START_DATE + datetime.timedelta(days=i) for i in range(args.days)]
+    with ConnectionManager() as conn:
+        cursor = conn.cursor()
+        insert_rows(cursor, "Patients", ("Username", "PasswordHash"),
+                    [("patient%d" % i, password_hash) for i in range(args.patients)])
+        insert_rows(cursor, "Caregivers", ("Username", "PasswordHash"),
+                    [("caregiver%d" % i, password_hash) for i in range(args.caregivers)])
+        insert_rows(cursor, "Vaccines", ("Name", "Doses", "Version"),
+                    [("vaccine%d" % i, args.doses, 0) for i in range(args.vaccines)])
+        for day in days:
+            insert_rows(cursor, "Availabilities", ("Time", "Username"),
+                        [(day, "caregiver%d" % i) for i in range(args.caregivers)])
+        conn.commit()
+    ConnectionManager.use_backend(None)
+
+
+def make_ops(command, args, rng, appointments):
+    # returns (command, username, tokens) for every call of the phase
+    ops = []
+    for i in range(args.ops):
+        patient = "patient%d" % rng.randrange(args.patients)
+        caregiver = "caregiver%d" % rng.randrange(args.caregivers)
+        day = format_date(START_DATE + datetime.timedelta(days=rng.randrange(args.days)))
+        vaccine = "vaccine%d" % rng.randrange(args.vaccines)
+        if command == "create_patient":
+            ops.append((command, None, [command, "newpatient%d" % i, PASSWORD]))
+        elif command == "login_patient":
+            ops.append((command, None, [command, patient, PASSWORD]))
+        elif command == "add_doses":
+            ops.append((command, caregiver, [command, vaccine, "10"]))
+        elif command == "search_caregiver_schedule":
+            ops.append((command, patient, [command, day]))
+        elif command == "reserve":
+            ops.append((command, patient, [command, day, vaccine]))
+        elif command == "reserve_earliest":
+            ops.append((command, patient, [command, vaccine, day]))
+        elif command == "show_appointments":
+            ops.append((command, patient, [command]))
+        elif command == "cancel":
+            if not appointments:
+                break
+            appt_id, owner = appointments.pop()
+            ops.append((command, owner, [command, str(appt_id)]))
+    return ops
+
+
+def init_worker(path):
+    os.environ.setdefault("HashWorkers", "0")
+    from db.Backend import SqliteBackend
+    from db.ConnectionManager import ConnectionManager
+    ConnectionManager.use_backend(SqliteBackend(path))
+
+
+def run_op(op):
+    from model.Caregiver import Caregiver
+    from model.Patient import Patient
+    from service.SchedulerSession import SchedulerSession
+
+    command, username, tokens = op
+    # act as the right user without paying for a login in every measurement
+    session = SchedulerSession()
+    if command == "add_doses":
+        session.caregiver = Caregiver(username)
+    elif username is not None:
+        session.patient = Patient(username)
+
+    start = time.perf_counter()
+    result = session.execute(tokens)
+    return time.perf_counter() - start, result.is_ok()
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(results, elapsed):
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    return {
+        "ops": len(results),
+        "succeeded": sum(1 for _, ok in results if ok),
+        "throughput": len(results) / elapsed if elapsed > 0 else None,
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def get_appointments(path):
+    import sqlite3
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT AppID, p_username FROM Appointments ORDER BY AppID").fetchall()
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduler command benchmark")
+    parser.add_argument("--patients", type=int, default=1000)
+    parser.add_argument("--caregivers", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--vaccines", type=int, default=3)
+    parser.add_argument("--doses", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--ops", type=int, default=200, help="calls per command")
+    parser.add_argument("--commands", nargs="+", choices=COMMANDS, default=COMMANDS)
+    parser.add_argument("--seed", type=int, default=1, help="random seed for the generated calls")
+    parser.add_argument("--db", help="SQLite file to create (default: a temporary file)")
+    parser.add_argument("--out", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    directory = None
+    path = args.db
+    if path is None:
+        directory = tempfile.TemporaryDirectory()
+        path = os.path.join(directory.name, "benchmark.db")
+    elif os.path.exists(path):
+        parser.error(args.db + " already exists")
+
+    seed(path, args)
+    rng = random.Random(args.seed)
+    report = {
+        "started": datetime.datetime.now().isoformat(timespec="seconds"),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("db", "out")},
+        "commands": {},
+    }
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(args.concurrency, initializer=init_worker, initargs=(path,)) as pool:
+        for command in args.commands:
+            appointments = get_appointments(path) if command == "cancel" else None
+            if appointments is not None:
+                rng.shuffle(appointments)
+            ops = make_ops(command, args, rng, appointments)
+            start = time.perf_counter()
+            results = pool.map(run_op, ops, chunksize=1)
+            report["commands"][command] = summarize(results, time.perf_counter() - start)
+            print(command, "done", file=sys.stderr)
+
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    if directory is not None:
+        directory.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import datetime
+import os
+import re
+import sqlite3
+from db.ConnectionPool import PoolTimeoutError
+
+try:
+    import pymssql
+except ImportError:
+    pymssql = None
+
+# driver exceptions of every available backend, for use in except clauses; a
+# connection pool that stays exhausted counts as one too, callers report it
+DatabaseError = (sqlite3.Error, PoolTimeoutError) + ((pymssql.Error,) if pymssql else ())
+IntegrityError = (sqlite3.IntegrityError,) + ((pymssql.IntegrityError,) if pymssql else ())
+
+
+class MssqlBackend:
+    '''
+    Azure SQL / SQL Server through pymssql, configured with the Server, DBName,
+    UserID and Password environment variables.
+    '''
+    name = "mssql"
+
+    def __init__(self):
+        if pymssql is None:
+            raise RuntimeError("DBBackend mssql requires the pymssql package")
+        self.server_name = os.getenv("Server") + ".database.windows.net"
+        self.db_name = os.getenv("DBName")
+        self.user = os.getenv("UserID")
+        self.password = os.getenv("Password")
+
+    def connect(self):
+        return pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
+
+    def split_script(self, script):
+        # batches are separated by lines holding only GO, as in sqlcmd
+        batches = re.split(r"^\s*GO\s*$", script, flags=re.MULTILINE | re.IGNORECASE)
+        return [batch for batch in batches if batch.strip()]
+
+
+class SqliteBackend:
+    '''
+    Embedded SQLite database file, configured with SQLitePath. Connections run in
+    WAL mode so readers never block the writer, keep up to 256 prepared statements
+    each, and accept the same %s/%d queries and cursor(as_dict=True) as pymssql.
+    '''
+    name = "sqlite"
+
+    pragmas = [
+        "PRAGMA journal_mode = WAL",
+        "PRAGMA synchronous = NORMAL",
+        "PRAGMA foreign_keys = ON",
+        "PRAGMA busy_timeout = 5000",
+        "PRAGMA temp_store = MEMORY",
+        "PRAGMA cache_size = -65536",
+        "PRAGMA mmap_size = 268435456",
+    ]
+
+    def __init__(self, path=None):
+        self.path = path or os.getenv("SQLitePath", "scheduler.db")
+
+    def connect(self):
+        conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False, cached_statements=256,
+                               detect_types=sqlite3.PARSE_DECLTYPES)
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        return SqliteConnection(conn)
+
+    def split_script(self, script):
+        # one statement per execute(), comments between statements are dropped
+        statements = []
+        current = ""
+        for line in script.splitlines(keepends=True):
+            if not current and (not line.strip() or line.strip().startswith("--")):
+                continue
+            current += line
+            if sqlite3.complete_statement(current):
+                statements.append(current)
+                current = ""
+        if current.strip():
+            statements.append(current)
+        return statements
+
+
+class SqliteConnection:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, as_dict=False):
+        return SqliteCursor(self.conn.cursor(), as_dict)
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class SqliteCursor:
+    placeholder = re.compile(r"%[sd]")
+
+    def __init__(self, cursor, as_dict):
+        self.cursor = cursor
+        self.as_dict = as_dict
+
+    def execute(self, operation, params=None):
+        if params is None:
+            params = ()
+        elif not isinstance(params, (tuple, list)):
+            # pymssql accepts a lone parameter without a tuple
+            params = (params,)
+        self.cursor.execute(self.placeholder.sub("?", operation), tuple(adapt(value) for value in params))
+        return self
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def fetchone(self):
+        return self.make_row(self.cursor.fetchone())
+
+    def fetchall(self):
+        return [self.make_row(row) for row in self.cursor.fetchall()]
+
+    def __iter__(self):
+        for row in self.cursor:
+            yield self.make_row(row)
+
+    def make_row(self, row):
+        if row is None or not self.as_dict:
+            return row
+        return {column[0]: value for column, value in zip(self.cursor.description, row)}
+
+    def close(self):
+        self.cursor.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def adapt(value):
+    # every temporal column in this schema is a DATE, stored by SQLite as yyyy-mm-dd
+    if isinstance(value, datetime.datetime):
+        return value.date().isoformat()
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    return value
+
+
+sqlite3.register_converter("date", lambda raw: datetime.date.fromisoformat(raw.decode()[:10]))
+
+
+def create_backend(name=None):
+    name = name or os.getenv("DBBackend", "mssql")
+    if name == "mssql":
+        return MssqlBackend()
+    if name == "sqlite":
+        return SqliteBackend()
+    raise ValueError("Unknown DBBackend: " + name)
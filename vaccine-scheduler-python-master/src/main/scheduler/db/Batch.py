@@ -0,0 +1,32 @@
+# SQL Server accepts at most 1000 rows per VALUES list and 2100 parameters per statement
+MAX_ROWS_PER_STATEMENT = 1000
+MAX_PARAMETERS_PER_STATEMENT = 2000
+
+
+def chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def insert_rows(cursor, table, columns, rows):
+    # inserts rows with as few multi-row INSERT statements as the server allows;
+    # the caller owns the transaction
+    rows = list(rows)
+    if not rows:
+        return 0
+    per_statement = min(MAX_ROWS_PER_STATEMENT, MAX_PARAMETERS_PER_STATEMENT // len(columns))
+    placeholders = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    for chunk in chunks(rows, per_statement):
+        statement = "INSERT INTO {} ({}) VALUES {}".format(
+            table, ", ".join(columns), ", ".join([placeholders] * len(chunk)))
+        cursor.execute(statement, tuple(value for row in chunk for value in row))
+    return len(rows)
+
+
+def select_existing(cursor, query, keys):
+    # query has one {} for the IN list; returns the first column of every matching row
+    found = set()
+    for chunk in chunks(list(keys), MAX_ROWS_PER_STATEMENT):
+        cursor.execute(query.format(", ".join(["%s"] * len(chunk))), tuple(chunk))
+        found.update(row[0] for row in cursor)
+    return found
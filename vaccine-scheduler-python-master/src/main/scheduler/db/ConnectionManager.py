@@ -1,29 +1,78 @@
-import pymssql
-import os
-
-
-class ConnectionManager:
-
-    def __init__(self):
-        self.server_name = os.getenv("Server") + ".database.windows.net"
-        self.db_name = os.getenv("DBName")
-        self.user = os.getenv("UserID")
-        self.password = os.getenv("Password")
-        self.conn = None
-
-    def create_connection(self):
-        try:
-            self.conn = pymssql.connect(server=self.server_name, user=self.user, password=self.password, database=self.db_name)
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
-        return self.conn
-
-    def close_connection(self):
-        try:
-            self.conn.close()
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! ")
-            print(db_err)
-            quit()
+import atexit
+import os
+import threading
+from db.Backend import DatabaseError, create_backend
+from db.ConnectionPool import ConnectionPool, PoolTimeoutError
+from db.MeteredConnection import MeteredConnection
+
+
+class ConnectionManager:
+    # one backend and one pool shared by every ConnectionManager in the process,
+    # created on first use; DBBackend selects mssql (default) or sqlite
+    backend = None
+    pool = None
+    pool_lock = threading.Lock()
+
+    def __init__(self):
+        self.conn = None
+
+    @classmethod
+    def get_backend(cls):
+        if cls.backend is None:
+            with cls.pool_lock:
+                if cls.backend is None:
+                    cls.backend = create_backend()
+        return cls.backend
+
+    @classmethod
+    def get_pool(cls):
+        if cls.pool is None:
+            backend = cls.get_backend()
+            with cls.pool_lock:
+                if cls.pool is None:
+                    cls.pool = ConnectionPool(
+                        lambda: MeteredConnection(backend.connect()),
+                        max_size=int(os.getenv("PoolSize", "10")),
+                        idle_timeout=float(os.getenv("PoolIdleTimeout", "300")),
+                        max_lifetime=float(os.getenv("PoolMaxLifetime", "1800")),
+                        checkout_timeout=float(os.getenv("PoolCheckoutTimeout", "30")),
+                    )
+                    atexit.register(cls.pool.close)
+        return cls.pool
+
+    @classmethod
+    def use_backend(cls, backend):
+        # switches the process to another backend, e.g. a SqliteBackend for a benchmark
+        with cls.pool_lock:
+            if cls.pool is not None:
+                cls.pool.close()
+            cls.backend = backend
+            cls.pool = None
+
+    def create_connection(self):
+        try:
+            self.conn = self.get_pool().checkout()
+        except PoolTimeoutError:
+            # every connection is busy for now, not a reason to quit: the caller
+            # reports it like any other database error
+            raise
+        except DatabaseError as db_err:
+            print("Database Programming Error in SQL connection processing! ")
+            print(db_err)
+            quit()
+        return self.conn
+
+    def close_connection(self):
+        # returns the connection to the pool; safe to call more than once
+        if self.conn is None:
+            return
+        conn, self.conn = self.conn, None
+        self.get_pool().checkin(conn)
+
+    def __enter__(self):
+        return self.create_connection()
+
+    def __exit__(self, exc_type, exc, tb):
+        # uncommitted work is rolled back on checkin, broken connections are dropped
+        self.close_connection()
+        return False
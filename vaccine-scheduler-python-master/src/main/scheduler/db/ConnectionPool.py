@@ -0,0 +1,153 @@
+import threading
+import time
+from util.Metrics import current_trace
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class PooledConnection:
+    def __init__(self, conn):
+        self.conn = conn
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class ConnectionPool:
+    '''
+    Bounded, thread-safe pool of database connections.
+    connect is a zero-argument callable that opens a new driver connection.
+    Idle connections are reused LIFO so the warmest ones are handed out first,
+    closed after idle_timeout seconds and recycled after max_lifetime seconds.
+    '''
+
+    def __init__(self, connect, max_size=10, idle_timeout=300, max_lifetime=1800,
+                 checkout_timeout=30, health_check_interval=30):
+        if max_size <= 0:
+            raise ValueError("Pool size must be positive!")
+        self.connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.checkout_timeout = checkout_timeout
+        self.health_check_interval = health_check_interval
+        self._idle = []
+        self._in_use = {}
+        self._size = 0
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def checkout(self):
+        deadline = time.monotonic() + self.checkout_timeout
+        while True:
+            entry = self._reserve(deadline)
+            new = entry is None
+            if new:
+                # we own a free slot in the pool, open a fresh connection for it
+                try:
+                    entry = PooledConnection(self.connect())
+                except BaseException:
+                    self._release_slot()
+                    raise
+            elif not self._usable(entry):
+                self._close_quietly(entry.conn)
+                self._release_slot()
+                continue
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+            trace = current_trace.get()
+            if trace is not None:
+                trace.add_connection(new)
+            return entry.conn
+
+    def checkin(self, conn, discard=False):
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None:
+            return
+        if not discard:
+            # never hand out a connection with an open transaction
+            try:
+                conn.rollback()
+            except Exception:
+                discard = True
+        now = time.monotonic()
+        if discard or self._closed or now - entry.created_at >= self.max_lifetime:
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+        entry.last_used = now
+        with self._cond:
+            self._idle.append(entry)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._close_quietly(entry.conn)
+
+    def _reserve(self, deadline):
+        # returns an idle entry, or None when the caller may open a new connection
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                expired = self._evict_idle()
+                if expired:
+                    self._cond.release()
+                    try:
+                        for entry in expired:
+                            self._close_quietly(entry.conn)
+                    finally:
+                        self._cond.acquire()
+                if self._idle:
+                    return self._idle.pop()
+                if self._size < self.max_size:
+                    self._size += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise PoolTimeoutError("Timed out waiting for a database connection")
+                self._cond.wait(remaining)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        keep = []
+        expired = []
+        for entry in self._idle:
+            if now - entry.last_used >= self.idle_timeout or now - entry.created_at >= self.max_lifetime:
+                expired.append(entry)
+            else:
+                keep.append(entry)
+        if expired:
+            self._idle = keep
+            self._size -= len(expired)
+        return expired
+
+    def _usable(self, entry):
+        if time.monotonic() - entry.last_used < self.health_check_interval:
+            return True
+        try:
+            cursor = entry.conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            return True
+        except Exception:
+            return False
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
@@ -0,0 +1,81 @@
+import time
+from util.Metrics import current_trace
+
+
+class MeteredConnection:
+    '''
+    Wraps a driver connection so that every query and every fetched row is
+    counted, and timed, on the trace of the command that runs it.
+    '''
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self, *args, **kwargs):
+        return MeteredCursor(self.conn.cursor(*args, **kwargs))
+
+    def commit(self):
+        start = time.perf_counter()
+        self.conn.commit()
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_query(time.perf_counter() - start)
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+class MeteredCursor:
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, operation, params=None):
+        start = time.perf_counter()
+        if params is None:
+            self.cursor.execute(operation)
+        else:
+            self.cursor.execute(operation, params)
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_query(time.perf_counter() - start)
+        return self
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self.cursor.fetchone()
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_rows(row is not None, time.perf_counter() - start)
+        return row
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self.cursor.fetchall()
+        trace = current_trace.get()
+        if trace is not None:
+            trace.add_rows(len(rows), time.perf_counter() - start)
+        return rows
+
+    def __iter__(self):
+        trace = current_trace.get()
+        for row in self.cursor:
+            if trace is not None:
+                trace.add_rows(1)
+            yield row
+
+    def __getattr__(self, name):
+        # rowcount, description, nextset, close, ...
+        return getattr(self.cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.cursor.close()
+        return False
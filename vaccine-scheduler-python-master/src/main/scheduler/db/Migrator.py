@@ -0,0 +1,136 @@
+'''
+Applies the versioned schema migrations in resources/migrations/<backend> to the
+configured database and records each applied version in the SchemaVersion table.
+
+Run from src/main/scheduler:
+    python -m db.Migrator --create   create the tables from resources/create.sql, then migrate
+    python -m db.Migrator            apply every pending migration
+    python -m db.Migrator --status   list migrations and whether they are applied
+
+Migration files are named <version>_<description>.sql and are applied in version
+order, each in its own transaction. SQL Server scripts may hold several batches
+separated by lines containing only GO. Table changes are also made in create.sql,
+so a migration must be a no-op against a database that already has its change;
+SQLite has no ADD COLUMN IF NOT EXISTS, so there an ALTER TABLE ... ADD COLUMN of
+a column the table already has is skipped.
+'''
+from db.ConnectionManager import ConnectionManager
+import argparse
+import os
+import re
+
+RESOURCES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources")
+ADD_COLUMN = re.compile(r"^\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+(?:COLUMN\s+)?(\w+)", re.IGNORECASE)
+
+
+class Migration:
+    def __init__(self, version, name, path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    def get_script(self):
+        with open(self.path) as f:
+            return f.read()
+
+
+class Migrator:
+    version_table = """
+            CREATE TABLE SchemaVersion (
+                Version int,
+                Name varchar(255),
+                AppliedAt datetime DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (Version)
+            )
+    """
+    create_version_table = {
+        "mssql": "IF OBJECT_ID('SchemaVersion', 'U') IS NULL" + version_table,
+        "sqlite": version_table.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS"),
+    }
+
+    def __init__(self, directory=None):
+        self.backend = ConnectionManager.get_backend()
+        self.directory = directory or os.path.join(RESOURCES_DIR, "migrations", self.backend.name)
+
+    def create_schema(self):
+        with open(os.path.join(RESOURCES_DIR, "create.sql")) as f:
+            script = f.read()
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            for statement in self.backend.split_script(script):
+                cursor.execute(statement)
+            conn.commit()
+
+    def get_migrations(self):
+        migrations = []
+        for filename in os.listdir(self.directory):
+            match = re.match(r"^(\d+)_(.+)\.sql$", filename)
+            if match:
+                migrations.append(Migration(int(match.group(1)), match.group(2), os.path.join(self.directory, filename)))
+        return sorted(migrations, key=lambda migration: migration.version)
+
+    def get_applied_versions(self):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.create_version_table[self.backend.name])
+            conn.commit()
+            cursor.execute("SELECT Version FROM SchemaVersion")
+            return {row[0] for row in cursor}
+
+    def get_current_version(self):
+        return max(self.get_applied_versions(), default=0)
+
+    def get_pending(self):
+        applied = self.get_applied_versions()
+        return [migration for migration in self.get_migrations() if migration.version not in applied]
+
+    def migrate(self, target=None):
+        applied = []
+        for migration in self.get_pending():
+            if target is not None and migration.version > target:
+                break
+            with ConnectionManager() as conn:
+                cursor = conn.cursor()
+                for batch in self.backend.split_script(migration.get_script()):
+                    if not self.has_change(cursor, batch):
+                        cursor.execute(batch)
+                cursor.execute("INSERT INTO SchemaVersion (Version, Name) VALUES (%d, %s)",
+                               (migration.version, migration.name))
+                conn.commit()
+            applied.append(migration)
+        return applied
+
+    def has_change(self, cursor, statement):
+        # whether a SQLite ADD COLUMN statement finds its column already there
+        match = ADD_COLUMN.match(statement)
+        if self.backend.name != "sqlite" or match is None:
+            return False
+        cursor.execute("PRAGMA table_info({})".format(match.group(1)))
+        return any(row[1].lower() == match.group(2).lower() for row in cursor.fetchall())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations")
+    parser.add_argument("--create", action="store_true", help="create the tables from create.sql first")
+    parser.add_argument("--status", action="store_true", help="list migrations without applying them")
+    parser.add_argument("--target", type=int, help="stop after this version")
+    args = parser.parse_args()
+
+    migrator = Migrator()
+    if args.create:
+        migrator.create_schema()
+        print("Created tables from create.sql")
+    if args.status:
+        applied = migrator.get_applied_versions()
+        for migration in migrator.get_migrations():
+            state = "applied" if migration.version in applied else "pending"
+            print("{:>4}  {:<40} {}".format(migration.version, migration.name, state))
+        return
+
+    for migration in migrator.migrate(args.target):
+        print("Applied migration", migration.version, migration.name)
+    print("Schema is at version", migrator.get_current_version())
+
+
+if __name__ == "__main__":
+    main()
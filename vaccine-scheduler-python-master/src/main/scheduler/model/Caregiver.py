@@ -1,45 +1,80 @@
 import sys
 sys.path.append("../util/*")
 sys.path.append("../db/*")
-from util.Util import Util
+from util.HashService import HashService
+from util.CredentialCache import CredentialCache
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Batch import insert_rows, select_existing
+from util import Slots
+import datetime
+from db.Backend import DatabaseError
 
 
 class Caregiver:
-    def __init__(self, username, password=None, salt=None, hash=None):
+    def __init__(self, username, password=None, salt=None, hash=None, password_hash=None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.password_hash = password_hash
 
     # getters
     def get(self):
+        cache = CredentialCache.get_instance()
+        row = cache.get_verified("Caregivers", self.username, self.password)
+        if row is not None:
+            self.password_hash = row['PasswordHash']
+            return self
+
+        row = cache.get_row("Caregivers", self.username)
+        if row is None:
+            row = self.get_credentials()
+            if row is None:
+                return None
+            cache.put_row("Caregivers", self.username, row)
+
+        matches, upgraded_hash = HashService.get_instance().check_credentials(
+            self.password, row['Salt'], row['Hash'], row['PasswordHash'])
+        if not matches:
+            # print("Incorrect password")
+            return None
+        if upgraded_hash is not None:
+            self.update_password_hash(upgraded_hash)
+            row = {'Salt': None, 'Hash': None, 'PasswordHash': upgraded_hash}
+            cache.put_row("Caregivers", self.username, row)
+        self.password_hash = row['PasswordHash']
+        cache.mark_verified("Caregivers", self.username, self.password)
+        return self
+
+    def get_credentials(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor(as_dict=True)
 
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
+        get_caregiver_details = "SELECT Salt, Hash, PasswordHash FROM Caregivers WHERE Username = %s"
         try:
             cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    # print("Incorrect password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
+            return cursor.fetchone()
+        except DatabaseError as e:
             raise e
         finally:
             cm.close_connection()
-        return None
+
+    # move the user to the current hash scheme
+    def update_password_hash(self, password_hash):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        update_hash = "UPDATE Caregivers SET Salt = NULL, Hash = NULL, PasswordHash = %s WHERE Username = %s"
+        try:
+            cursor.execute(update_hash, (password_hash, self.username))
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        CredentialCache.get_instance().invalidate("Caregivers", self.username)
 
     def get_username(self):
         return self.username
@@ -50,34 +85,99 @@ class Caregiver:
     def get_hash(self):
         return self.hash
 
+    def get_password_hash(self):
+        return self.password_hash
+
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
+        add_caregivers = "INSERT INTO Caregivers (Username, Salt, Hash, PasswordHash) VALUES (%s, %s, %s, %s)"
         try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            cursor.execute(add_caregivers, (self.username, self.salt, self.hash, self.password_hash))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             raise
         finally:
             cm.close_connection()
+        CredentialCache.get_instance().invalidate("Caregivers", self.username)
 
-    # Insert availability with parameter date d
-    def upload_availability(self, d):
+    # Insert many caregivers in one transaction. Usernames that are already taken
+    # (or repeated within caregivers) are skipped and returned.
+    @staticmethod
+    def save_all(caregivers):
+        taken = []
+        unique = {}
+        for user in caregivers:
+            if user.username in unique:
+                taken.append(user.username)
+            else:
+                unique[user.username] = user
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            try:
+                existing = select_existing(cursor, "SELECT Username FROM Caregivers WHERE Username IN ({})", unique)
+                rows = [(u.username, u.salt, u.hash, u.password_hash) for u in unique.values() if u.username not in existing]
+                insert_rows(cursor, "Caregivers", ("Username", "Salt", "Hash", "PasswordHash"), rows)
+                conn.commit()
+            except DatabaseError:
+                raise
+        for username in unique:
+            CredentialCache.get_instance().invalidate("Caregivers", username)
+        return taken + [username for username in unique if username in existing]
+
+    # Insert availability with parameter date d, a day of slots time slots
+    # of which those already booked are left out
+    def upload_availability(self, d, slots=1):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
+        get_booked = "SELECT Slot FROM Appointments WHERE c_username = %s AND Time = %s"
+        add_availability = "INSERT INTO Availabilities (Time, Username, Slots) VALUES (%s, %s, %d)"
         try:
-            cursor.execute(add_availability, (d, self.username))
+            cursor.execute(get_booked, (self.username, d))
+            free = Slots.full(slots) & ~Slots.union(Slots.bit(row[0]) for row in cursor)
+            if free == 0:
+                raise ValueError("All slots of that day are already booked!")
+            cursor.execute(add_availability, (d, self.username, free))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when updating caregiver availability")
             raise
         finally:
             cm.close_connection()
+
+    # Insert availability of slots time slots for every date in dates
+    def upload_availabilities(self, dates, slots=1):
+        return len(self.upload_days({d.date() if isinstance(d, datetime.datetime) else d: slots for d in dates}))
+
+    # Insert availability for every date of days, a dict of date -> number of slots,
+    # within one transaction, skipping dates that are already uploaded or fully booked.
+    # Returns the dates that were inserted.
+    def upload_days(self, days):
+        dates = sorted(days)
+        if not dates:
+            return []
+
+        get_existing = "SELECT Time FROM Availabilities WHERE Username = %s AND Time BETWEEN %s AND %s"
+        get_booked = "SELECT Time, Slot FROM Appointments WHERE c_username = %s AND Time BETWEEN %s AND %s"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(get_existing, (self.username, dates[0], dates[-1]))
+                existing = {row[0] for row in cursor}
+                cursor.execute(get_booked, (self.username, dates[0], dates[-1]))
+                booked = {}
+                for time, slot in cursor:
+                    booked[time] = booked.get(time, 0) | Slots.bit(slot)
+                rows = [(d, self.username, Slots.full(days[d]) & ~booked.get(d, 0)) for d in dates if d not in existing]
+                rows = [row for row in rows if row[2] != 0]
+                insert_rows(cursor, "Availabilities", ("Time", "Username", "Slots"), rows)
+                conn.commit()
+            except DatabaseError:
+                raise
+        return [row[0] for row in rows]
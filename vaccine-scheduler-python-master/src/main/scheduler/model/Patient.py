@@ -1,43 +1,76 @@
 import sys
-from util.Util import Util
+from util.HashService import HashService
+from util.CredentialCache import CredentialCache
 sys.path.append("../util/*")
 sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Batch import insert_rows, select_existing
+from db.Backend import DatabaseError
 
 class Patient:
 
-    def __init__(self, username, password = None, salt = None, hash = None):
+    def __init__(self, username, password = None, salt = None, hash = None, password_hash = None):
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.password_hash = password_hash
     
     def get(self):
+        cache = CredentialCache.get_instance()
+        row = cache.get_verified("Patients", self.username, self.password)
+        if row is not None:
+            self.password_hash = row['PasswordHash']
+            return self
+
+        row = cache.get_row("Patients", self.username)
+        if row is None:
+            row = self.get_credentials()
+            if row is None:
+                return None
+            cache.put_row("Patients", self.username, row)
+
+        matches, upgraded_hash = HashService.get_instance().check_credentials(
+            self.password, row['Salt'], row['Hash'], row['PasswordHash'])
+        if not matches:
+            return None
+        if upgraded_hash is not None:
+            self.update_password_hash(upgraded_hash)
+            row = {'Salt': None, 'Hash': None, 'PasswordHash': upgraded_hash}
+            cache.put_row("Patients", self.username, row)
+        self.password_hash = row['PasswordHash']
+        cache.mark_verified("Patients", self.username, self.password)
+        return self
+
+    def get_credentials(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor(as_dict=True)
-        get_details = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
+
+        get_details = "SELECT Salt, Hash, PasswordHash FROM Patients WHERE Username = %s"
         try:
             cursor.execute(get_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    print("Incorrect username and/or password")
-                    cm.close_connection()
-                    return None
-                else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
+            return cursor.fetchone()
+        except DatabaseError as e:
             raise e
         finally:
             cm.close_connection()
-        return None
+
+    # move the user to the current hash scheme
+    def update_password_hash(self, password_hash):
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = conn.cursor()
+
+        update_hash = "UPDATE Patients SET Salt = NULL, Hash = NULL, PasswordHash = %s WHERE Username = %s"
+        try:
+            cursor.execute(update_hash, (password_hash, self.username))
+            conn.commit()
+        except DatabaseError:
+            raise
+        finally:
+            cm.close_connection()
+        CredentialCache.get_instance().invalidate("Patients", self.username)
 
     def get_username(self):
         return self.username
@@ -48,18 +81,44 @@ class Patient:
     def get_hash(self):
         return self.hash
 
+    def get_password_hash(self):
+        return self.password_hash
+
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_patient = "INSERT INTO Patients VALUES (%s, %s, %s)"
+        add_patient = "INSERT INTO Patients (Username, Salt, Hash, PasswordHash) VALUES (%s, %s, %s, %s)"
         try:
-            cursor.execute(add_patient, (self.username, self.salt, self.hash))
+            cursor.execute(add_patient, (self.username, self.salt, self.hash, self.password_hash))
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             raise
         finally:
             cm.close_connection()
+        CredentialCache.get_instance().invalidate("Patients", self.username)
 
-
+    # Insert many patients in one transaction. Usernames that are already taken
+    # (or repeated within patients) are skipped and returned.
+    @staticmethod
+    def save_all(patients):
+        taken = []
+        unique = {}
+        for user in patients:
+            if user.username in unique:
+                taken.append(user.username)
+            else:
+                unique[user.username] = user
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            try:
+                existing = select_existing(cursor, "SELECT Username FROM Patients WHERE Username IN ({})", unique)
+                rows = [(u.username, u.salt, u.hash, u.password_hash) for u in unique.values() if u.username not in existing]
+                insert_rows(cursor, "Patients", ("Username", "Salt", "Hash", "PasswordHash"), rows)
+                conn.commit()
+            except DatabaseError:
+                raise
+        for username in unique:
+            CredentialCache.get_instance().invalidate("Patients", username)
+        return taken + [username for username in unique if username in existing]
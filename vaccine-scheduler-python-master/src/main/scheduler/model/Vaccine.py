@@ -1,13 +1,14 @@
 import sys
 sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
 
 
 class Vaccine:
-    def __init__(self, vaccine_name, available_doses):
+    def __init__(self, vaccine_name, available_doses, version=None):
         self.vaccine_name = vaccine_name
         self.available_doses = available_doses
+        self.version = version
 
     # getters
     def get(self):
@@ -15,13 +16,14 @@ class Vaccine:
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
+        get_vaccine = "SELECT Name, Doses, Version FROM Vaccines WHERE Name = %s"
         try:
             cursor.execute(get_vaccine, self.vaccine_name)
             for row in cursor:
                 self.available_doses = row[1]
+                self.version = row[2]
                 return self
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when getting Vaccine")
             raise
         finally:
@@ -34,6 +36,9 @@ class Vaccine:
     def get_available_doses(self):
         return self.available_doses
 
+    def get_version(self):
+        return self.version
+
     def save_to_db(self):
         if self.available_doses is None or self.available_doses <= 0:
             raise ValueError("Argument cannot be negative!")
@@ -42,58 +47,60 @@ class Vaccine:
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
+        add_doses = "INSERT INTO Vaccines (Name, Doses, Version) VALUES (%s, %d, 0)"
         try:
             cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+            self.version = 0
+        except DatabaseError:
             # print("Error occurred when insert Vaccines")
             raise
         finally:
             cm.close_connection()
 
-    # Increment the available doses
+    # Increment the available doses. Changes are applied as relative deltas in the
+    # database, so concurrent updates are never lost; available_doses and version
+    # are refreshed from the updated row.
     def increase_available_doses(self, num):
         if num <= 0:
             raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
-
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
-        try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            # print("Error occurred when updating vaccine availability")
-            raise
-        finally:
-            cm.close_connection()
+        update_vaccine_availability = "UPDATE Vaccines SET Doses = Doses + %d, Version = Version + 1 WHERE Name = %s"
+        if not self.update_doses(update_vaccine_availability, (num, self.vaccine_name)):
+            raise ValueError("Vaccine not found!")
 
-    # Decrement the available doses
+    # Decrement the available doses, never below zero
     def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
 
+        update_vaccine_availability = ("UPDATE Vaccines SET Doses = Doses - %d, Version = Version + 1 "
+                                       "WHERE Name = %s AND Doses >= %d")
+        if not self.update_doses(update_vaccine_availability, (num, self.vaccine_name, num)):
+            raise ValueError("Not enough available doses!")
+
+    def update_doses(self, update_vaccine_availability, params):
         cm = ConnectionManager()
         conn = cm.create_connection()
         cursor = conn.cursor()
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+        get_vaccine = "SELECT Doses, Version FROM Vaccines WHERE Name = %s"
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
+            cursor.execute(update_vaccine_availability, params)
+            if cursor.rowcount == 0:
+                return False
+            # the updated row stays locked until commit, so this read sees our own change
+            cursor.execute(get_vaccine, self.vaccine_name)
+            self.available_doses, self.version = cursor.fetchone()
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             # print("Error occurred when updating vaccine availability")
             raise
         finally:
             cm.close_connection()
+        return True
 
     def __str__(self):
         return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
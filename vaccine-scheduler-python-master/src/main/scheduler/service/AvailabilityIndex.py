@@ -0,0 +1,86 @@
+from db.ConnectionManager import ConnectionManager
+import datetime
+import itertools
+import os
+import threading
+import time
+
+
+class AvailabilityIndex:
+    '''
+    In-memory index of free caregivers per day and the bitmaps of their free
+    time slots, filled by range scans of Availabilities and kept for ttl seconds. Days are recorded even when nobody
+    is available, so a repeated search over a covered range needs no query.
+    Code that changes availability invalidates the affected days; changes made
+    by other processes show up once the ttl expires.
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, ttl=2):
+        self.ttl = ttl
+        self.days = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    cls.instance = cls(float(os.getenv("AvailabilityTTL", "2")))
+        return cls.instance
+
+    def get_range(self, start, end):
+        # yields (date, caregivers) for every day in [start, end] with a free caregiver,
+        # caregivers maps each username to its bitmap of free slots
+        cached = self.get_cached(start, end)
+        if cached is not None:
+            return iter(cached)
+        return self.load_range(start, end)
+
+    def get_cached(self, start, end):
+        now = time.monotonic()
+        days = []
+        with self.lock:
+            for day in date_range(start, end):
+                entry = self.days.get(day)
+                if entry is None or now - entry[0] >= self.ttl:
+                    return None
+                if entry[1]:
+                    days.append((day, dict(entry[1])))
+        return days
+
+    def load_range(self, start, end):
+        get_availabilities = ("SELECT Time, Username, Slots FROM Availabilities WHERE Time BETWEEN %s AND %s "
+                              "ORDER BY Time, Username")
+        loaded_at = time.monotonic()
+        found = {}
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(get_availabilities, (start, end))
+            # rows arrive ordered by day, hand each day out as soon as it is complete
+            for day, rows in itertools.groupby(cursor, key=lambda row: row[0]):
+                caregivers = {row[1]: row[2] for row in rows}
+                found[day] = caregivers
+                yield day, caregivers
+        with self.lock:
+            for day in date_range(start, end):
+                self.days[day] = (loaded_at, found.get(day, {}))
+            expired = [day for day, entry in self.days.items() if loaded_at - entry[0] >= self.ttl]
+            for day in expired:
+                del self.days[day]
+
+    def invalidate(self, day=None):
+        if isinstance(day, datetime.datetime):
+            day = day.date()
+        with self.lock:
+            if day is None:
+                self.days.clear()
+            else:
+                self.days.pop(day, None)
+
+
+def date_range(start, end):
+    for i in range((end - start).days + 1):
+        yield start + datetime.timedelta(days=i)
@@ -0,0 +1,371 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from service.IdAllocator import IdAllocator
+from service.VaccineInventory import VaccineInventory
+from service.AvailabilityIndex import AvailabilityIndex
+from service.CaregiverAssigner import CaregiverAssigner, as_date
+from model.Vaccine import Vaccine
+from util import Slots
+from db.Backend import DatabaseError
+from db.Batch import MAX_PARAMETERS_PER_STATEMENT, MAX_ROWS_PER_STATEMENT, chunks, insert_rows
+
+
+class BookingResult:
+    BOOKED = "booked"
+    NO_CAREGIVER = "no_caregiver"
+    NO_VACCINE = "no_vaccine"
+    NO_DOSES = "no_doses"
+
+    def __init__(self, status, appointment_id=None, caregiver=None, slot=None, date=None):
+        self.status = status
+        self.appointment_id = appointment_id
+        self.caregiver = caregiver
+        self.slot = slot
+        self.date = date
+
+    def is_booked(self):
+        return self.status == BookingResult.BOOKED
+
+    def get_appointment_id(self):
+        return self.appointment_id
+
+    def get_caregiver(self):
+        return self.caregiver
+
+    def get_slot(self):
+        return self.slot
+
+    def get_date(self):
+        return self.date
+
+
+class BookingEngine:
+    '''
+    Books an appointment as a single transaction, sent to SQL Server as one batch:
+    claim a caregiver for the date, take one dose with a guarded decrement,
+    insert the appointment for the caregiver's first free time slot and clear
+    that slot's bit in the caregiver's Slots bitmap (the row goes once no slot
+    is left, so every row of Availabilities has a free slot).
+    The caregiver CaregiverAssigner prefers (the least loaded one) is claimed with
+    a primary key seek, so concurrent reservations for a date lock different rows;
+    if it is gone any other free caregiver is taken. READPAST lets concurrent
+    reservations skip each other's claimed caregivers instead of queueing on them;
+    a claimed caregiver may still have free slots afterwards, so a reservation
+    that finds every row of the day claimed waits for them before it gives up.
+    The guarded UPDATE means a vaccine can never go below zero doses.
+    reserve_earliest() books the first free slot from a date on: the earliest day
+    is found with a seek on the (Time, Username) primary key, and if all of it is
+    claimed before the reservation gets there, the reservation claims the first
+    free caregiver from that date on with one more seek inside its transaction.
+    '''
+
+    reserve_batch = """
+        SET NOCOUNT ON;
+        DECLARE @app_id int = %d, @time date = %s, @vaccine varchar(255) = %s, @patient varchar(255) = %s,
+                @preferred varchar(255) = %s, @from date = %s;
+        DECLARE @caregiver varchar(255), @status varchar(20) = 'booked', @doses int, @version int;
+        DECLARE @slots int, @bit int, @slot int;
+
+        IF @preferred IS NOT NULL
+            SELECT @caregiver = Username, @slots = Slots FROM Availabilities WITH (UPDLOCK, ROWLOCK, READPAST)
+                WHERE Time = @time AND Username = @preferred;
+        IF @caregiver IS NULL AND @from IS NULL
+            SELECT TOP 1 @caregiver = Username, @slots = Slots FROM Availabilities WITH (UPDLOCK, ROWLOCK, READPAST)
+                WHERE Time = @time ORDER BY Username;
+        IF @caregiver IS NULL AND @from IS NOT NULL
+            SELECT TOP 1 @caregiver = Username, @slots = Slots, @time = Time
+                FROM Availabilities WITH (UPDLOCK, ROWLOCK, READPAST)
+                WHERE Time >= @from ORDER BY Time, Username;
+        -- the rows READPAST skipped are claimed by reservations in flight, which may leave slots free
+        IF @caregiver IS NULL AND @from IS NULL
+            SELECT TOP 1 @caregiver = Username, @slots = Slots FROM Availabilities WITH (UPDLOCK, ROWLOCK)
+                WHERE Time = @time ORDER BY Username;
+        IF @caregiver IS NULL AND @from IS NOT NULL
+            SELECT TOP 1 @caregiver = Username, @slots = Slots, @time = Time
+                FROM Availabilities WITH (UPDLOCK, ROWLOCK)
+                WHERE Time >= @from ORDER BY Time, Username;
+
+        IF @caregiver IS NULL
+            SET @status = 'no_caregiver';
+        ELSE
+        BEGIN
+            UPDATE Vaccines SET @doses = Doses = Doses - 1, @version = Version = Version + 1
+                WHERE Name = @vaccine AND Doses > 0;
+            IF @@ROWCOUNT = 0
+                SET @status = CASE WHEN EXISTS (SELECT 1 FROM Vaccines WHERE Name = @vaccine)
+                                   THEN 'no_doses' ELSE 'no_vaccine' END;
+            ELSE
+            BEGIN
+                -- the lowest set bit is the first free slot
+                SET @bit = @slots & -@slots;
+                SET @slot = CAST(ROUND(LOG(@bit, 2), 0) AS int);
+                INSERT INTO Appointments (AppID, c_username, p_username, Time, Name, Slot)
+                    VALUES (@app_id, @caregiver, @patient, @time, @vaccine, @slot);
+                IF @slots = @bit
+                    DELETE FROM Availabilities WHERE Time = @time AND Username = @caregiver;
+                ELSE
+                    UPDATE Availabilities SET Slots = Slots - @bit WHERE Time = @time AND Username = @caregiver;
+            END
+        END
+
+        SELECT @status AS Status, @caregiver AS Caregiver, @time AS Time, @doses AS Doses, @version AS Version,
+               @slot AS Slot, @slots - @bit AS Remaining;
+    """
+
+    def __init__(self, id_allocator=None, inventory=None, assigner=None):
+        self.id_allocator = id_allocator or IdAllocator.for_appointments()
+        self.inventory = inventory or VaccineInventory.get_instance()
+        self.assigner = assigner or CaregiverAssigner.get_instance()
+
+    def reserve(self, patient_username, date, vaccine_name, start=None):
+        # books a slot on date, or with date None the first free slot on or after start
+        # turn away unknown or sold out vaccines without touching the caregivers
+        vaccine = self.inventory.get_in_stock(vaccine_name)
+        if vaccine is None:
+            return BookingResult(BookingResult.NO_VACCINE)
+        if vaccine.get_available_doses() <= 0:
+            return BookingResult(BookingResult.NO_DOSES)
+        if date is None:
+            date = self.earliest_date(start)
+            if date is None:
+                return BookingResult(BookingResult.NO_CAREGIVER)
+
+        # ids of failed attempts are simply skipped
+        appt_id = self.id_allocator.next_id()
+        preferred = self.assigner.pick(date)
+        try:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                try:
+                    if ConnectionManager.get_backend().name == "mssql":
+                        cursor.execute(self.reserve_batch,
+                                       (appt_id, date, vaccine_name, patient_username, preferred, start))
+                        row = cursor.fetchone()
+                    else:
+                        row = self.reserve_statements(cursor, appt_id, date, vaccine_name, patient_username,
+                                                      preferred, start)
+                    status = row["Status"]
+                    if status == BookingResult.BOOKED:
+                        result = BookingResult(status, appt_id, row["Caregiver"], row["Slot"], as_date(row["Time"]))
+                    else:
+                        result = BookingResult(status, caregiver=row["Caregiver"])
+                    if result.is_booked():
+                        conn.commit()
+                    else:
+                        conn.rollback()
+                except DatabaseError:
+                    conn.rollback()
+                    raise
+        except Exception:
+            if preferred is not None:
+                self.assigner.release(date, preferred)
+            raise
+        self.assign(date, preferred, result, row["Remaining"] if result.is_booked() else 0)
+        if result.is_booked():
+            self.inventory.apply(Vaccine(vaccine_name, row["Doses"], row["Version"]))
+            AvailabilityIndex.get_instance().invalidate(result.get_date())
+        elif result.status == BookingResult.NO_DOSES:
+            self.inventory.invalidate(vaccine_name)
+        return result
+
+    def reserve_many(self, reservations, before_commit=None):
+        # books (patient_username, date, vaccine_name) reservations in order as one transaction:
+        # the caregivers of their dates and their vaccines are locked and read, every reservation
+        # is resolved against them in memory and the outcome is written with a few set-based
+        # statements and a single commit. before_commit(cursor, results) may add its own
+        # statements to the transaction, or raise to roll it back. Returns a BookingResult
+        # per reservation.
+        reservations = [(patient, as_date(date), vaccine_name) for patient, date, vaccine_name in reservations]
+        if not reservations:
+            return []
+        # ids are taken before the transaction, those of failed reservations are skipped
+        ids = [self.id_allocator.next_id() for _ in reservations]
+        preferred = [self.assigner.pick(date) for _, date, _ in reservations]
+        try:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                try:
+                    free, vaccines = self.lock_many(cursor, reservations)
+                    results, appointments = self.resolve_many(reservations, ids, preferred, free, vaccines)
+                    self.write_many(cursor, appointments, free, vaccines)
+                    if before_commit is not None:
+                        before_commit(cursor, results)
+                    conn.commit()
+                except DatabaseError:
+                    conn.rollback()
+                    raise
+        except Exception:
+            for (_, date, _), caregiver in zip(reservations, preferred):
+                if caregiver is not None:
+                    self.assigner.release(date, caregiver)
+            raise
+
+        index = AvailabilityIndex.get_instance()
+        for (_, date, vaccine_name), caregiver, result in zip(reservations, preferred, results):
+            remaining = free[(date, result.get_caregiver())][1] if result.is_booked() else 0
+            self.assign(date, caregiver, result, remaining)
+            if result.is_booked():
+                index.invalidate(date)
+            elif result.status == BookingResult.NO_DOSES:
+                self.inventory.invalidate(vaccine_name)
+        for name, (doses, version, taken) in vaccines.items():
+            if taken:
+                self.inventory.apply(Vaccine(name, doses, version + 1))
+        return results
+
+    def lock_many(self, cursor, reservations):
+        # returns {(date, caregiver): [slots read, slots left]} and {vaccine: [doses, version, doses taken]};
+        # no READPAST, a row claimed by another transaction may still have free slots once it commits
+        if ConnectionManager.get_backend().name == "mssql":
+            get_availabilities = ("SELECT Time, Username, Slots FROM Availabilities WITH (UPDLOCK, ROWLOCK) "
+                                  "WHERE Time IN ({}) ORDER BY Time, Username")
+            get_vaccines = "SELECT Name, Doses, Version FROM Vaccines WITH (UPDLOCK, ROWLOCK) WHERE Name IN ({})"
+        else:
+            cursor.execute("BEGIN IMMEDIATE")
+            get_availabilities = ("SELECT Time, Username, Slots FROM Availabilities WHERE Time IN ({}) "
+                                  "ORDER BY Time, Username")
+            get_vaccines = "SELECT Name, Doses, Version FROM Vaccines WHERE Name IN ({})"
+        free = {}
+        for chunk in chunks(sorted({date for _, date, _ in reservations}), MAX_ROWS_PER_STATEMENT):
+            cursor.execute(get_availabilities.format(", ".join(["%s"] * len(chunk))), tuple(chunk))
+            for row in cursor.fetchall():
+                free[(row["Time"], row["Username"])] = [row["Slots"], row["Slots"]]
+        vaccines = {}
+        for chunk in chunks(sorted({vaccine_name for _, _, vaccine_name in reservations}), MAX_ROWS_PER_STATEMENT):
+            cursor.execute(get_vaccines.format(", ".join(["%s"] * len(chunk))), tuple(chunk))
+            for row in cursor.fetchall():
+                vaccines[row["Name"]] = [row["Doses"], row["Version"], 0]
+        return free, vaccines
+
+    def resolve_many(self, reservations, ids, preferred, free, vaccines):
+        # books reservations in order against the locked rows, changing free and vaccines in place;
+        # returns the results and the appointment rows to insert
+        caregivers = {}
+        for date, caregiver in free:
+            caregivers.setdefault(date, []).append(caregiver)
+        results = []
+        appointments = []
+        for (patient, date, vaccine_name), appt_id, caregiver in zip(reservations, ids, preferred):
+            vaccine = vaccines.get(vaccine_name)
+            if vaccine is None:
+                results.append(BookingResult(BookingResult.NO_VACCINE))
+                continue
+            if caregiver is None or not free.get((date, caregiver), [0, 0])[1]:
+                caregiver = next((c for c in caregivers.get(date, []) if free[(date, c)][1]), None)
+            if caregiver is None:
+                results.append(BookingResult(BookingResult.NO_CAREGIVER))
+                continue
+            if vaccine[0] <= 0:
+                results.append(BookingResult(BookingResult.NO_DOSES, caregiver=caregiver))
+                continue
+            slots = free[(date, caregiver)]
+            slot = Slots.lowest(slots[1])
+            slots[1] &= ~Slots.bit(slot)
+            vaccine[0] -= 1
+            vaccine[2] += 1
+            appointments.append((appt_id, caregiver, patient, date, vaccine_name, slot))
+            results.append(BookingResult(BookingResult.BOOKED, appt_id, caregiver, slot, date))
+        return results, appointments
+
+    def write_many(self, cursor, appointments, free, vaccines):
+        insert_rows(cursor, "Appointments", ("AppID", "c_username", "p_username", "Time", "Name", "Slot"), appointments)
+
+        taken = [(name, vaccine[2]) for name, vaccine in sorted(vaccines.items()) if vaccine[2]]
+        for chunk in chunks(taken, MAX_PARAMETERS_PER_STATEMENT // 3):
+            cases = " ".join(["WHEN %s THEN %d"] * len(chunk))
+            names = ", ".join(["%s"] * len(chunk))
+            cursor.execute("UPDATE Vaccines SET Doses = Doses - CASE Name " + cases + " END, Version = Version + 1 "
+                           "WHERE Name IN (" + names + ")",
+                           tuple(value for row in chunk for value in row) + tuple(name for name, _ in chunk))
+
+        changed = [(key, slots[1]) for key, slots in sorted(free.items()) if slots[0] != slots[1]]
+        emptied = [key for key, left in changed if left == 0]
+        for chunk in chunks(emptied, MAX_PARAMETERS_PER_STATEMENT // 2):
+            keys = " OR ".join(["(Time = %s AND Username = %s)"] * len(chunk))
+            cursor.execute("DELETE FROM Availabilities WHERE " + keys, tuple(value for key in chunk for value in key))
+        left = [(key, slots) for key, slots in changed if slots != 0]
+        for chunk in chunks(left, MAX_PARAMETERS_PER_STATEMENT // 5):
+            cases = " ".join(["WHEN Time = %s AND Username = %s THEN %d"] * len(chunk))
+            keys = " OR ".join(["(Time = %s AND Username = %s)"] * len(chunk))
+            cursor.execute("UPDATE Availabilities SET Slots = CASE " + cases + " END WHERE " + keys,
+                           tuple(value for key, slots in chunk for value in key + (slots,))
+                           + tuple(value for key, _ in chunk for value in key))
+
+    def reserve_earliest(self, patient_username, vaccine_name, start):
+        return self.reserve(patient_username, None, vaccine_name, start)
+
+    def earliest_date(self, start):
+        # the first day from start on with a free slot, a seek on the primary key
+        if ConnectionManager.get_backend().name == "mssql":
+            get_earliest = "SELECT TOP 1 Time FROM Availabilities WHERE Time >= %s ORDER BY Time"
+        else:
+            get_earliest = "SELECT Time FROM Availabilities WHERE Time >= %s ORDER BY Time LIMIT 1"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(get_earliest, start)
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def assign(self, date, preferred, result, remaining):
+        # tells the assigner what happened to the caregiver it picked for date
+        caregiver = result.get_caregiver() if result.is_booked() else None
+        booked_preferred = caregiver == preferred and result.get_date() == as_date(date)
+        if preferred is not None and not booked_preferred:
+            if caregiver is not None or result.status == BookingResult.NO_CAREGIVER:
+                # someone else got the preferred caregiver first
+                self.assigner.forget(date, preferred)
+            else:
+                self.assigner.release(date, preferred)
+        if caregiver is not None:
+            self.assigner.booked(result.get_date(), caregiver, remaining != 0)
+        elif result.status == BookingResult.NO_CAREGIVER:
+            self.assigner.invalidate(date)
+
+    def reserve_statements(self, cursor, appt_id, date, vaccine_name, patient_username, preferred=None, start=None):
+        # the same steps as reserve_batch for an embedded database, where round trips
+        # are free; BEGIN IMMEDIATE takes the write lock before the caregiver is chosen
+        row = {"Status": BookingResult.BOOKED, "Caregiver": None, "Time": date, "Doses": None, "Version": None,
+               "Slot": None, "Remaining": None}
+        cursor.execute("BEGIN IMMEDIATE")
+        caregiver = None
+        if preferred is not None:
+            cursor.execute("SELECT Username, Slots FROM Availabilities WHERE Time = %s AND Username = %s",
+                           (date, preferred))
+            caregiver = cursor.fetchone()
+        if caregiver is None and start is None:
+            cursor.execute("SELECT Username, Slots FROM Availabilities WHERE Time = %s ORDER BY Username LIMIT 1",
+                           date)
+            caregiver = cursor.fetchone()
+        if caregiver is None and start is not None:
+            cursor.execute("SELECT Username, Slots, Time FROM Availabilities WHERE Time >= %s "
+                           "ORDER BY Time, Username LIMIT 1", start)
+            caregiver = cursor.fetchone()
+            if caregiver is not None:
+                row["Time"] = caregiver["Time"]
+        if caregiver is None:
+            row["Status"] = BookingResult.NO_CAREGIVER
+            return row
+        row["Caregiver"] = caregiver["Username"]
+        date = row["Time"]
+
+        cursor.execute("UPDATE Vaccines SET Doses = Doses - 1, Version = Version + 1 WHERE Name = %s AND Doses > 0",
+                       vaccine_name)
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT Name FROM Vaccines WHERE Name = %s", vaccine_name)
+            row["Status"] = BookingResult.NO_DOSES if cursor.fetchone() else BookingResult.NO_VACCINE
+            return row
+        cursor.execute("SELECT Doses, Version FROM Vaccines WHERE Name = %s", vaccine_name)
+        row.update(cursor.fetchone())
+
+        row["Slot"] = Slots.lowest(caregiver["Slots"])
+        row["Remaining"] = caregiver["Slots"] & ~Slots.bit(row["Slot"])
+        cursor.execute("INSERT INTO Appointments (AppID, c_username, p_username, Time, Name, Slot) "
+                       "VALUES (%d, %s, %s, %s, %s, %d)",
+                       (appt_id, row["Caregiver"], patient_username, date, vaccine_name, row["Slot"]))
+        if row["Remaining"] == 0:
+            cursor.execute("DELETE FROM Availabilities WHERE Time = %s AND Username = %s", (date, row["Caregiver"]))
+        else:
+            cursor.execute("UPDATE Availabilities SET Slots = %d WHERE Time = %s AND Username = %s",
+                           (row["Remaining"], date, row["Caregiver"]))
+        return row
@@ -0,0 +1,117 @@
+from db.ConnectionManager import ConnectionManager
+from db.Batch import MAX_ROWS_PER_STATEMENT, chunks
+from service.VaccineInventory import VaccineInventory
+from service.AvailabilityIndex import AvailabilityIndex
+from service.CaregiverAssigner import CaregiverAssigner
+from model.Vaccine import Vaccine
+from util import Slots
+from db.Backend import DatabaseError
+
+
+class CancellationEngine:
+    '''
+    Cancels any number of appointments as one transaction: the appointments are
+    locked, the caregivers' time slots are offered again (when a patient cancels)
+    by setting their bits in Availabilities.Slots, every vaccine gets its doses
+    back with one relative increment, and the appointments are deleted, each
+    step set-based statements per chunk of up to MAX_ROWS_PER_STATEMENT
+    appointments. Either all of it happens or nothing. Availabilities is written
+    before Vaccines, the order BookingEngine locks them in, so a cancellation and
+    a reservation never wait for each other's locks.
+    '''
+
+    return_doses = """
+        UPDATE Vaccines SET Doses = Doses + (SELECT COUNT(*) FROM Appointments
+                                             WHERE Appointments.Name = Vaccines.Name AND AppID IN ({ids})),
+                            Version = Version + 1
+        WHERE Name IN (SELECT Name FROM Appointments WHERE AppID IN ({ids}))
+    """
+
+    # the bits of distinct slots of a day add up to their bitwise or
+    restore_slots = """
+        UPDATE Availabilities SET Slots = Slots | (SELECT SUM(DISTINCT {bit}) FROM Appointments
+                                                   WHERE AppID IN ({ids})
+                                                   AND Appointments.Time = Availabilities.Time
+                                                   AND Appointments.c_username = Availabilities.Username)
+        WHERE EXISTS (SELECT 1 FROM Appointments WHERE AppID IN ({ids})
+                      AND Appointments.Time = Availabilities.Time
+                      AND Appointments.c_username = Availabilities.Username)
+    """
+
+    restore_availability = """
+        INSERT INTO Availabilities (Time, Username, Slots)
+        SELECT Time, c_username, SUM(DISTINCT {bit}) FROM Appointments
+        WHERE AppID IN ({ids}) AND NOT EXISTS (SELECT 1 FROM Availabilities
+                                               WHERE Availabilities.Time = Appointments.Time
+                                               AND Availabilities.Username = Appointments.c_username)
+        GROUP BY Time, c_username
+    """
+
+    def __init__(self, inventory=None):
+        self.inventory = inventory or VaccineInventory.get_instance()
+
+    def cancel(self, appointment_ids, patient_username=None, caregiver_username=None):
+        # cancels those of appointment_ids that belong to the given patient or caregiver,
+        # returns the cancelled appointments as dicts (AppID, Name, Time, c_username)
+        ids = sorted(set(appointment_ids))
+        if not ids:
+            return []
+        column, username = self.owner(patient_username, caregiver_username)
+        return self.run("AppID IN ({}) AND " + column + " = %s", ids, username, patient_username is not None)
+
+    def cancel_day(self, date, patient_username=None, caregiver_username=None):
+        # cancels everything the patient or caregiver has on date, e.g. when a clinic closes
+        column, username = self.owner(patient_username, caregiver_username)
+        return self.run("Time = %s AND " + column + " = %s", [date], username, patient_username is not None)
+
+    def owner(self, patient_username, caregiver_username):
+        if patient_username is not None:
+            return "p_username", patient_username
+        if caregiver_username is not None:
+            return "c_username", caregiver_username
+        raise ValueError("Appointments can only be cancelled by their patient or caregiver!")
+
+    def run(self, where, values, username, restore):
+        # where has a {} for the placeholders of values, followed by the owner check
+        lock = " WITH (UPDLOCK, ROWLOCK)" if ConnectionManager.get_backend().name == "mssql" else ""
+        select = "SELECT AppID, Name, Time, c_username FROM Appointments" + lock + " WHERE " + where + " ORDER BY AppID"
+        with ConnectionManager() as conn:
+            cursor = conn.cursor(as_dict=True)
+            try:
+                if ConnectionManager.get_backend().name != "mssql":
+                    # take the write lock before reading what to cancel
+                    cursor.execute("BEGIN IMMEDIATE")
+                cancelled = []
+                for chunk in chunks(values, MAX_ROWS_PER_STATEMENT):
+                    cursor.execute(select.format(", ".join(["%s"] * len(chunk))), tuple(chunk) + (username,))
+                    cancelled.extend(cursor.fetchall())
+                vaccines = []
+                if cancelled:
+                    batches = [(", ".join(["%d"] * len(chunk)), tuple(chunk))
+                               for chunk in chunks([row["AppID"] for row in cancelled], MAX_ROWS_PER_STATEMENT)]
+                    if restore:
+                        bit = Slots.bit_sql("Slot")
+                        for ids, chunk in batches:
+                            cursor.execute(self.restore_slots.format(ids=ids, bit=bit), chunk * 2)
+                            cursor.execute(self.restore_availability.format(ids=ids, bit=bit), chunk)
+                    for ids, chunk in batches:
+                        cursor.execute(self.return_doses.format(ids=ids), chunk * 2)
+                    for ids, chunk in batches:
+                        cursor.execute("DELETE FROM Appointments WHERE AppID IN ({})".format(ids), chunk)
+                    names = sorted({row["Name"] for row in cancelled})
+                    cursor.execute("SELECT Name, Doses, Version FROM Vaccines WHERE Name IN ({})".format(
+                        ", ".join(["%s"] * len(names))), tuple(names))
+                    vaccines = [Vaccine(row["Name"], row["Doses"], row["Version"]) for row in cursor.fetchall()]
+                conn.commit()
+            except DatabaseError:
+                conn.rollback()
+                raise
+        for vaccine in vaccines:
+            self.inventory.apply(vaccine)
+        index = AvailabilityIndex.get_instance()
+        for day in {row["Time"] for row in cancelled}:
+            index.invalidate(day)
+        assigner = CaregiverAssigner.get_instance()
+        for row in cancelled:
+            assigner.cancelled(row["Time"], row["c_username"], restore)
+        return cancelled
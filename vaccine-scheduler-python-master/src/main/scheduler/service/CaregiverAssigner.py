@@ -0,0 +1,147 @@
+from db.ConnectionManager import ConnectionManager
+import datetime
+import heapq
+import os
+import threading
+import time
+
+
+class DaySlots:
+    def __init__(self, loaded_at, caregivers, loads):
+        self.loaded_at = loaded_at
+        self.free = set(caregivers)
+        self.heap = [(loads.get(caregiver, 0), caregiver) for caregiver in caregivers]
+        heapq.heapify(self.heap)
+
+
+class CaregiverAssigner:
+    '''
+    Chooses the caregiver for a reservation. For every date it keeps the free
+    caregivers in a heap keyed by their number of appointments, so a booking goes
+    to the least loaded caregiver in O(log n) without a query, and concurrent
+    bookings for a date are spread over different caregivers instead of all
+    queueing on the alphabetically first one.
+    A caregiver handed out by pick() leaves the day until release() puts it back,
+    so two reservations in this process are never offered the same caregiver.
+    The choice is only a preference: BookingEngine still claims the row in the
+    database and takes another free caregiver if the preferred one is gone.
+    A date is loaded with one query when first needed (or once ttl seconds have
+    passed, to pick up changes made by other processes).
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, ttl=30):
+        self.ttl = ttl
+        self.days = {}
+        self.loads = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    cls.instance = cls(float(os.getenv("AssignerTTL", "30")))
+        return cls.instance
+
+    def pick(self, date):
+        # returns the least loaded free caregiver for date, or None if there is none
+        date = as_date(date)
+        with self.lock:
+            day = self.get_day(date)
+        if day is None:
+            day = self.load_day(date)
+        with self.lock:
+            while day.heap:
+                load, caregiver = heapq.heappop(day.heap)
+                if caregiver not in day.free:
+                    continue
+                current = self.loads.get(caregiver, 0)
+                if load != current:
+                    # booked elsewhere since it was queued, queue it again at its real load
+                    heapq.heappush(day.heap, (current, caregiver))
+                    continue
+                day.free.discard(caregiver)
+                return caregiver
+        return None
+
+    def booked(self, date, caregiver, has_free_slots=False):
+        # caregiver got an appointment on date, whether or not pick() chose it
+        with self.lock:
+            self.loads[caregiver] = self.loads.get(caregiver, 0) + 1
+            day = self.days.get(as_date(date))
+            if day is not None:
+                day.free.discard(caregiver)
+            if has_free_slots:
+                self.free(as_date(date), caregiver)
+
+    def release(self, date, caregiver):
+        # caregiver is free on date again: picked but not booked, or a slot was uploaded
+        with self.lock:
+            self.free(as_date(date), caregiver)
+
+    def cancelled(self, date, caregiver, restored):
+        # an appointment of caregiver on date was cancelled, restored if its slot is offered again
+        with self.lock:
+            if self.loads.get(caregiver, 0) > 0:
+                self.loads[caregiver] -= 1
+            if restored:
+                self.free(as_date(date), caregiver)
+
+    def forget(self, date, caregiver):
+        # a picked caregiver turned out to be taken already
+        with self.lock:
+            day = self.days.get(as_date(date))
+            if day is not None:
+                day.free.discard(caregiver)
+
+    def invalidate(self, date=None):
+        with self.lock:
+            if date is None:
+                self.days.clear()
+            else:
+                self.days.pop(as_date(date), None)
+
+    def free(self, date, caregiver):
+        day = self.days.get(date)
+        if day is not None and caregiver not in self.loads:
+            # a caregiver we know nothing about, the day is loaded again with its load
+            del self.days[date]
+        elif day is not None and caregiver not in day.free:
+            day.free.add(caregiver)
+            heapq.heappush(day.heap, (self.loads.get(caregiver, 0), caregiver))
+
+    def get_day(self, date):
+        day = self.days.get(date)
+        if day is None or time.monotonic() - day.loaded_at >= self.ttl:
+            return None
+        return day
+
+    def load_day(self, date):
+        get_caregivers = ("SELECT Username, (SELECT COUNT(*) FROM Appointments WHERE c_username = Username) "
+                          "FROM Availabilities WHERE Time = %s")
+        loaded_at = time.monotonic()
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(get_caregivers, date)
+            rows = cursor.fetchall()
+        with self.lock:
+            day = self.get_day(date)
+            if day is not None:
+                # another thread loaded it meanwhile and may have handed out caregivers
+                return day
+            for caregiver, load in rows:
+                self.loads[caregiver] = load
+            day = self.days[date] = DaySlots(loaded_at, [row[0] for row in rows], self.loads)
+            expired = [d for d, entry in self.days.items() if loaded_at - entry.loaded_at >= self.ttl]
+            for d in expired:
+                del self.days[d]
+        return day
+
+
+def as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    return value
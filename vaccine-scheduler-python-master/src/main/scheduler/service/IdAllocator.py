@@ -0,0 +1,87 @@
+import sys
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+import os
+import threading
+from db.Backend import IntegrityError
+
+
+class DbBlockSource:
+    '''
+    Reserves ranges of ids by bumping the counter row for name in IdBlocks.
+    The row is seeded from seed_query (the next free id) the first time it is used.
+    '''
+
+    def __init__(self, name, seed_query):
+        self.name = name
+        self.seed_query = seed_query
+
+    def reserve(self, size):
+        # returns the first id of a freshly reserved range [start, start + size)
+        bump_counter = "UPDATE IdBlocks SET NextValue = NextValue + %d WHERE Name = %s"
+        seed_counter = "INSERT INTO IdBlocks (Name, NextValue) VALUES (%s, %d)"
+        get_counter = "SELECT NextValue FROM IdBlocks WHERE Name = %s"
+        while True:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(bump_counter, (size, self.name))
+                    if cursor.rowcount == 0:
+                        cursor.execute(self.seed_query)
+                        cursor.execute(seed_counter, (self.name, cursor.fetchone()[0] + size))
+                    cursor.execute(get_counter, self.name)
+                    end = cursor.fetchone()[0]
+                    conn.commit()
+                    return end - size
+                except IntegrityError:
+                    # another process seeded the counter first, bump it instead
+                    conn.rollback()
+
+
+class IdAllocator:
+    '''
+    Hands out unique, increasing ids from blocks reserved in the database, so only
+    one reservation in every block_size needs a round trip. Ids left in a block
+    when the process exits are never reused, which leaves gaps but no duplicates.
+    '''
+
+    appointments = None
+    waitlist = None
+    appointments_lock = threading.Lock()
+
+    def __init__(self, source, block_size=50):
+        if block_size <= 0:
+            raise ValueError("Block size must be positive!")
+        self.source = source
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def for_appointments(cls):
+        if cls.appointments is None:
+            with cls.appointments_lock:
+                if cls.appointments is None:
+                    source = DbBlockSource("Appointments", "SELECT COALESCE(MAX(AppID), 0) + 1 FROM Appointments")
+                    cls.appointments = cls(source, int(os.getenv("AppIdBlockSize", "50")))
+        return cls.appointments
+
+    @classmethod
+    def for_waitlist(cls):
+        # blocks of one, so ids follow the order entries are queued in across processes
+        if cls.waitlist is None:
+            with cls.appointments_lock:
+                if cls.waitlist is None:
+                    source = DbBlockSource("Waitlist", "SELECT COALESCE(MAX(WaitID), 0) + 1 FROM Waitlist")
+                    cls.waitlist = cls(source, 1)
+        return cls.waitlist
+
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self.source.reserve(self.block_size)
+                self._end = self._next + self.block_size
+            allocated = self._next
+            self._next += 1
+            return allocated
@@ -0,0 +1,127 @@
+from service.BookingEngine import BookingEngine
+from util.Metrics import Metrics
+import os
+import queue
+import threading
+import time
+
+
+class ReservationTimeout(Exception):
+    # the writer did not take the reservation up in time, it was not booked
+    pass
+
+
+class ReservationRequest:
+    def __init__(self, patient_username, date, vaccine_name):
+        self.patient_username = patient_username
+        self.date = date
+        self.vaccine_name = vaccine_name
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        # set under the coordinator's lock: taken by the writer or withdrawn by the session
+        self.taken = False
+        self.withdrawn = False
+
+
+class ReservationCoordinator:
+    '''
+    Group commit for reservations. Sessions hand their reservations to one writer
+    thread, which collects whatever arrives within window seconds of the first
+    one (at most size of them) and books the lot with BookingEngine.reserve_many,
+    one transaction and one commit for the whole batch; every session then gets
+    its own BookingResult back. Under load a commit is shared by many reservations
+    instead of every reservation waiting for its own.
+    With a window of 0 (the default, ReserveBatchWindow is in milliseconds) every
+    reservation is booked on its own in the calling thread.
+    A writer that dies is replaced by the next reservation, and a reservation the
+    writer has not taken up within timeout seconds is withdrawn and fails with
+    ReservationTimeout instead of waiting forever.
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, window=0.0, size=100, timeout=60.0):
+        self.window = window
+        self.size = size
+        self.timeout = timeout
+        self.requests = queue.Queue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    cls.instance = cls(float(os.getenv("ReserveBatchWindow", "0")) / 1000,
+                                       int(os.getenv("ReserveBatchSize", "100")),
+                                       float(os.getenv("ReserveTimeout", "60")))
+        return cls.instance
+
+    def reserve(self, patient_username, date, vaccine_name):
+        if self.window <= 0:
+            return BookingEngine().reserve(patient_username, date, vaccine_name)
+        request = ReservationRequest(patient_username, date, vaccine_name)
+        self.start()
+        self.requests.put(request)
+        deadline = time.monotonic() + self.timeout
+        while not request.done.wait(min(1.0, self.timeout)):
+            self.start()
+            if time.monotonic() >= deadline and self.withdraw(request):
+                raise ReservationTimeout("Timed out waiting for the reservation to be booked")
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def start(self):
+        with self.lock:
+            if self.writer is None or not self.writer.is_alive():
+                self.writer = threading.Thread(target=self.run, name="reservations", daemon=True)
+                self.writer.start()
+
+    def run(self):
+        engine = BookingEngine()
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            batch = [request for request in batch if self.take(request)]
+            if batch:
+                self.write(engine, batch)
+
+    def take(self, request):
+        # the writer books the request unless its session gave up on it
+        with self.lock:
+            request.taken = not request.withdrawn
+            return request.taken
+
+    def withdraw(self, request):
+        # the session gives up on the request unless the writer is booking it already
+        with self.lock:
+            request.withdrawn = not request.taken
+            return request.withdrawn
+
+    def write(self, engine, batch):
+        try:
+            with Metrics.get_instance().command("reserve_batch"):
+                results = engine.reserve_many([(request.patient_username, request.date, request.vaccine_name)
+                                               for request in batch])
+            for request, result in zip(batch, results):
+                request.result = result
+        except BaseException as e:
+            # the whole batch was rolled back, every session sees the error and the
+            # writer carries on with the next batch
+            for request in batch:
+                request.error = e
+        finally:
+            for request in batch:
+                request.done.set()
@@ -0,0 +1,720 @@
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from util.HashService import HashService
+from util.Metrics import Metrics
+from db.ConnectionManager import ConnectionManager
+from service.BookingEngine import BookingEngine, BookingResult
+from service.CancellationEngine import CancellationEngine
+from service.ReservationCoordinator import ReservationCoordinator, ReservationTimeout
+from service.WaitlistEngine import WaitlistEngine
+from service.VaccineInventory import VaccineInventory
+from service.AvailabilityIndex import AvailabilityIndex
+from service.CaregiverAssigner import CaregiverAssigner
+from db.Backend import DatabaseError, IntegrityError
+from db.ConnectionPool import PoolTimeoutError
+from util import Slots
+import datetime
+
+# command names accepted by execute(), also the label values of the command metrics
+COMMANDS = ["create_patient", "create_caregiver", "login_patient", "login_caregiver",
+            "search_caregiver_schedule", "reserve", "reserve_earliest", "upload_availability",
+            "upload_availability_range", "cancel", "add_doses", "show_appointments", "logout", "quit"]
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+class CommandResult:
+    '''
+    Outcome of one command: whether it did what was asked, the lines the
+    command line application shows for it, and the data behind them.
+    fatal marks database failures after which the command line application quits.
+    '''
+
+    def __init__(self, ok, lines, data=None, fatal=False, stop=False):
+        self.ok = ok
+        self.lines = lines
+        self.data = data
+        self.fatal = fatal
+        self.stop = stop
+
+    def is_ok(self):
+        return self.ok
+
+    def get_lines(self):
+        return self.lines
+
+    def get_data(self):
+        return self.data
+
+    def text(self):
+        return "".join(line + "\n" for line in self.lines)
+
+    def to_dict(self):
+        return {"ok": self.ok, "lines": self.lines, "data": self.data}
+
+
+def done(*lines, data=None):
+    return CommandResult(True, list(lines), data)
+
+
+def failed(*lines, fatal=False):
+    return CommandResult(False, list(lines), fatal=fatal)
+
+
+class AppointmentListing(CommandResult):
+    '''
+    Result of show_appointments. consume() walks the cursor one row at a time and
+    either hands every line to write as soon as it is formatted, keeping nothing,
+    or collects the lines and the appointments in the result.
+    '''
+
+    row_format = "{: >10}\t{: >10}\t{: >10}\t{: >10}\t"
+
+    def __init__(self, sql, params, other, limit):
+        CommandResult.__init__(self, True, [])
+        self.sql = sql
+        self.params = params
+        self.other = other
+        self.limit = limit
+
+    def consume(self, write=None):
+        emit = write or self.lines.append
+        role = "caregiver" if self.other == "c_username" else "patient"
+        appointments = []
+        count = 0
+        last_id = None
+        try:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                cursor.execute(self.sql, self.params)
+                for appointment in cursor:
+                    if count == 0:
+                        emit(self.row_format.format("Appointment ID", "Vaccine", "Date", self.other.split('_')[0].title()))
+                    emit(self.row_format.format(appointment["AppID"], appointment["Name"], str(appointment["Time"]),
+                                                appointment[self.other]))
+                    if write is None:
+                        appointments.append({"appointment_id": appointment["AppID"], "vaccine": appointment["Name"],
+                                             "date": str(appointment["Time"]), role: appointment[self.other]})
+                    count += 1
+                    last_id = appointment["AppID"]
+        except DatabaseError:
+            self.ok = False
+            emit("Data retrieve failed! Please try again!")
+            return self
+        except Exception as e:
+            self.ok = False
+            emit("Error occured. Try again! " + str(e))
+            return self
+
+        if count == 0:
+            emit("There are no appointments scheduled")
+        next_after_id = last_id if self.limit is not None and count == self.limit else None
+        if next_after_id is not None:
+            emit(f"More appointments may follow, continue with --after-id {next_after_id}")
+        self.data = {"appointments": appointments if write is None else None, "count": count,
+                     "next_after_id": next_after_id}
+        return self
+
+
+class SchedulerSession:
+    '''
+    Login state and commands of one user of the scheduler. Sessions share no
+    state, so any number of them can run side by side in one process, one
+    command at a time each. execute() takes a command line split into tokens;
+    the other methods take parsed arguments (show_appointments() returns an
+    AppointmentListing that still has to be consumed).
+    Note: at most one of patient and caregiver is set, since only one user can
+    be logged in to a session at a time.
+    '''
+
+    def __init__(self):
+        self.patient = None
+        self.caregiver = None
+
+    def get_patient(self):
+        return self.patient
+
+    def get_caregiver(self):
+        return self.caregiver
+
+    def is_logged_in(self):
+        return self.patient is not None or self.caregiver is not None
+
+    def execute(self, tokens, write=None):
+        # write, if given, receives the lines of a listing one by one as they are read
+        operation = tokens[0]
+        # unknown names are traced together so they cannot flood the metrics
+        with Metrics.get_instance().command(operation if operation in COMMANDS else "invalid"):
+            result = self.run(operation, tokens)
+            if isinstance(result, AppointmentListing):
+                result.consume(write)
+            return result
+
+    def run(self, operation, tokens):
+        parsed = self.parse(operation, tokens)
+        if isinstance(parsed, CommandResult):
+            return parsed
+        method, args = parsed
+        return getattr(self, method)(*args)
+
+    def parse(self, operation, tokens):
+        # checks a command line against the grammar and the login state; returns the
+        # method to run and its arguments, or the CommandResult of a rejected command
+        if operation in ("create_patient", "create_caregiver"):
+            if len(tokens) != 3:
+                return failed("Failed to create user.")
+            if operation == "create_patient":
+                return "create_patient", (tokens[1], tokens[2])
+            return "create_caregiver", (tokens[1], tokens[2])
+        if operation in ("login_patient", "login_caregiver"):
+            if self.is_logged_in():
+                return failed("User already logged in.")
+            if len(tokens) != 3:
+                return failed("Login failed.")
+            if operation == "login_patient":
+                return "login_patient", (tokens[1], tokens[2])
+            return "login_caregiver", (tokens[1], tokens[2])
+        if operation == "search_caregiver_schedule":
+            if not self.is_logged_in():
+                return failed("Please login first!")
+            if len(tokens) == 3:
+                try:
+                    start_date = extract_date(tokens[1]).date()
+                    end_date = extract_date(tokens[2]).date()
+                except (ValueError, IndexError):
+                    return failed("Please enter a valid date. Try again!")
+                return "search_caregiver_schedule_range", (start_date, end_date)
+            if len(tokens) != 2:
+                return failed("Please try again!")
+            try:
+                date = extract_date(tokens[1])
+            except (ValueError, IndexError):
+                return failed("Please enter a valid date. Try again!")
+            return "search_caregiver_schedule", (date,)
+        if operation == "reserve":
+            if not self.is_logged_in():
+                return failed("Please login first!")
+            if self.patient is None:
+                return failed("You need to be logged in as a patient. Please login first!")
+            if len(tokens) != 3:
+                return failed("Please try again!")
+            try:
+                date = extract_date(tokens[1])
+            except (ValueError, IndexError):
+                return failed("Please enter a valid date!")
+            return "reserve", (date, tokens[2])
+        if operation == "reserve_earliest":
+            #  reserve_earliest <vaccine> [<date>], the first free slot from date (default today) on
+            if not self.is_logged_in():
+                return failed("Please login first!")
+            if self.patient is None:
+                return failed("You need to be logged in as a patient. Please login first!")
+            if len(tokens) not in (2, 3):
+                return failed("Please try again!")
+            try:
+                start = extract_date(tokens[2]).date() if len(tokens) == 3 else datetime.date.today()
+            except (ValueError, IndexError):
+                return failed("Please enter a valid date!")
+            return "reserve_earliest", (tokens[1], start)
+        if operation == "upload_availability":
+            #  upload_availability <date> [--slots <n>]
+            if self.caregiver is None:
+                return failed("Please login as a caregiver first!")
+            try:
+                tokens, slots = split_slots(tokens)
+            except ValueError:
+                return failed(f"Please enter a number of slots between 1 and {Slots.MAX_SLOTS}!")
+            if len(tokens) != 2:
+                return failed("Please try again!")
+            try:
+                date = extract_date(tokens[1])
+            except (ValueError, IndexError):
+                return failed("Please enter a valid date!")
+            return "upload_availability", (date, slots)
+        if operation == "upload_availability_range":
+            #  upload_availability_range <start> <end> [weekdays] [--slots <n>]
+            #  weekdays is an optional comma separated list such as mon,wed,fri
+            if self.caregiver is None:
+                return failed("Please login as a caregiver first!")
+            try:
+                tokens, slots = split_slots(tokens)
+            except ValueError:
+                return failed(f"Please enter a number of slots between 1 and {Slots.MAX_SLOTS}!")
+            if len(tokens) not in (3, 4):
+                return failed("Please try again!")
+            try:
+                start_date = extract_date(tokens[1]).date()
+                end_date = extract_date(tokens[2]).date()
+            except (ValueError, IndexError):
+                return failed("Please enter a valid date!")
+            weekdays = None
+            if len(tokens) == 4:
+                names = tokens[3].lower().split(",")
+                if any(name not in WEEKDAYS for name in names):
+                    return failed("Please enter weekdays as a comma separated list such as mon,wed,fri!")
+                weekdays = {WEEKDAYS.index(name) for name in names}
+            return "upload_availability_range", (start_date, end_date, weekdays, slots)
+        if operation == "cancel":
+            if not self.is_logged_in():
+                return failed("Please login first!")
+            # cancel <appointment_id> [<appointment_id> ...] or cancel --date <date>
+            if len(tokens) < 2:
+                return failed("Please try again!")
+            if tokens[1] == "--date":
+                if len(tokens) != 3:
+                    return failed("Please try again!")
+                try:
+                    date = extract_date(tokens[2])
+                except (ValueError, IndexError):
+                    return failed("Please enter a valid date. Try again!")
+                return "cancel_day", (date,)
+            try:
+                appointment_ids = [int(token) for token in tokens[1:]]
+            except ValueError:
+                return failed("Please try again!")
+            return "cancel", (appointment_ids,)
+        if operation == "add_doses":
+            if self.caregiver is None:
+                return failed("Please login as a caregiver first!")
+            if len(tokens) != 3:
+                return failed("Please try again!")
+            try:
+                doses = int(tokens[2])
+            except ValueError as e:
+                return failed("Error occurred when adding doses", "Error: " + str(e))
+            return "add_doses", (tokens[1], doses)
+        if operation == "show_appointments":
+            if not self.is_logged_in():
+                return failed("Please login first!")
+            # show_appointments [--from-date <date>] [--limit <n>] [--after-id <id>]
+            options = dict(zip(tokens[1::2], tokens[2::2]))
+            if len(tokens) % 2 == 0 or len(options) != len(tokens) // 2 \
+                    or any(name not in ("--from-date", "--limit", "--after-id") for name in options):
+                return failed("Please try again!")
+            try:
+                from_date = extract_date(options["--from-date"]) if "--from-date" in options else None
+            except (ValueError, IndexError):
+                return failed("Please enter a valid date. Try again!")
+            try:
+                limit = int(options["--limit"]) if "--limit" in options else None
+                after_id = int(options["--after-id"]) if "--after-id" in options else None
+            except ValueError:
+                return failed("Please try again!")
+            if limit is not None and limit <= 0:
+                return failed("Please try again!")
+            return "show_appointments", (from_date, limit, after_id)
+        if operation == "logout":
+            if not self.is_logged_in():
+                return failed("Please login first!")
+            if len(tokens) != 1:
+                return failed("Please try again!")
+            return "logout", ()
+        if operation == "quit":
+            return CommandResult(True, ["Bye!"], stop=True)
+        return failed("Invalid operation name!")
+
+    def create_patient(self, username, password):
+        return self.create_user(Patient, username, password)
+
+    def create_caregiver(self, username, password):
+        return self.create_user(Caregiver, username, password)
+
+    def create_user(self, model, username, password):
+        problem = password_problem(password)
+        if problem is not None:
+            return failed(problem)
+
+        password_hash = HashService.get_instance().hash_password(password)
+        # the primary key on Username rejects taken usernames, no separate lookup needed
+        try:
+            model(username, password_hash=password_hash).save_to_db()
+        except IntegrityError:
+            return failed("Username taken, try again!")
+        except PoolTimeoutError as e:
+            # every connection is busy for now, the command can simply be tried again
+            return failed("Failed to create user.", "Db-Error: " + str(e))
+        except DatabaseError as e:
+            return failed("Failed to create user.", "Db-Error: " + str(e), fatal=True)
+        except Exception as e:
+            return failed("Failed to create user.", str(e))
+        return done("Created user  " + username, data={"username": username})
+
+    def login_patient(self, username, password):
+        try:
+            patient = Patient(username, password=password).get()
+        except PoolTimeoutError as e:
+            return failed("Login failed.", "Db-Error: " + str(e))
+        except DatabaseError as e:
+            return failed("Login failed.", "Db-Error: " + str(e), fatal=True)
+        except Exception as e:
+            return failed("Login failed.", "Error: " + str(e))
+        if patient is None:
+            return failed("Login failed.")
+        self.patient = patient
+        return done("Logged in as: " + username, data={"username": username, "role": "patient"})
+
+    def login_caregiver(self, username, password):
+        try:
+            caregiver = Caregiver(username, password=password).get()
+        except PoolTimeoutError as e:
+            return failed("Login failed.", "Db-Error: " + str(e))
+        except DatabaseError as e:
+            return failed("Login failed.", "Db-Error: " + str(e), fatal=True)
+        except Exception as e:
+            return failed("Login failed.", "Error: " + str(e))
+        if caregiver is None:
+            return failed("Login failed.")
+        self.caregiver = caregiver
+        return done("Logged in as: " + username, data={"username": username, "role": "caregiver"})
+
+    def search_caregiver_schedule(self, date):
+        get_availablities = "SELECT Time, Username, Slots FROM Availabilities WHERE Time = %s ORDER BY Username"
+        try:
+            with ConnectionManager() as conn:
+                cursor = conn.cursor(as_dict=True)
+                cursor.execute(get_availablities, date)
+                schedule = cursor.fetchall()
+            vaccines = VaccineInventory.get_instance().get_all()
+        except DatabaseError:
+            return failed("Data retrieve failed! Please try again!")
+        except Exception:
+            return failed("Error occured. Try again!")
+
+        lines = []
+        if len(schedule) <= 0:
+            lines.append("Sorry, no available appointments for the date " + date.strftime("%m-%d-%Y"))
+        header = ["Caregiver"] + [vaccine.get_vaccine_name().rjust(10) for vaccine in vaccines] + ["Free slots"]
+        lines.append("\t".join(header))
+        lines.append("-" * ((len(vaccines) + 1) * 20))
+        for row in schedule:
+            doses = [str(vaccine.get_available_doses()).rjust(10) for vaccine in vaccines]
+            lines.append("\t".join([row['Username']] + doses + [Slots.describe(row['Slots'])]))
+        data = {
+            "date": date.date().isoformat(),
+            "caregivers": [row['Username'] for row in schedule],
+            "slots": {row['Username']: Slots.slots_of(row['Slots']) for row in schedule},
+            "free_slots": Slots.slots_of(Slots.union(row['Slots'] for row in schedule)),
+            "doses": {vaccine.get_vaccine_name(): vaccine.get_available_doses() for vaccine in vaccines},
+        }
+        return done(*lines, data=data)
+
+    def search_caregiver_schedule_range(self, start_date, end_date):
+        # one line per day with free caregivers: how many, how many free slots they
+        # have, how many of each vaccine can still be booked that day, and who they are
+        if end_date < start_date:
+            return failed("The end date must not be before the start date!")
+        try:
+            vaccines = VaccineInventory.get_instance().get_all()
+            header = ["Date".ljust(10), "Caregivers", "Slots".rjust(10)]
+            header += [vaccine.get_vaccine_name().rjust(10) for vaccine in vaccines]
+            lines = ["\t".join(header + ["Available caregivers"]), "-" * ((len(vaccines) + 4) * 20)]
+            days = []
+            for day, caregivers in AvailabilityIndex.get_instance().get_range(start_date, end_date):
+                slots = sum(Slots.count(bitmap) for bitmap in caregivers.values())
+                bookable = {vaccine.get_vaccine_name(): min(vaccine.get_available_doses(), slots)
+                            for vaccine in vaccines}
+                row = ([day.strftime("%m-%d-%Y"), str(len(caregivers)).rjust(10), str(slots).rjust(10)]
+                       + [str(count).rjust(10) for count in bookable.values()] + [", ".join(caregivers)])
+                lines.append("\t".join(row))
+                days.append({"date": day.isoformat(), "caregivers": list(caregivers), "slots": slots,
+                             "free_slots": Slots.slots_of(Slots.union(caregivers.values())), "bookable": bookable})
+        except DatabaseError:
+            return failed("Data retrieve failed! Please try again!")
+        except Exception:
+            return failed("Error occured. Try again!")
+        if not days:
+            lines.append("Sorry, no available appointments between %s and %s"
+                         % (start_date.strftime("%m-%d-%Y"), end_date.strftime("%m-%d-%Y")))
+        return done(*lines, data=days)
+
+    def reserve(self, date, vaccine_name):
+        try:
+            booking = ReservationCoordinator.get_instance().reserve(self.patient.username, date, vaccine_name)
+        except DatabaseError as e:
+            return failed("Error occurred when making reservation", "Db-Error: " + str(e))
+        except ReservationTimeout as e:
+            return failed("Error occurred when making reservation", "Error: " + str(e))
+        return self.wait(self.booked(booking, vaccine_name), booking, date, vaccine_name)
+
+    def reserve_batch(self, reservations):
+        # consecutive reserve lines of a script as (date, vaccine) pairs, booked in one
+        # transaction. Returns one result per reservation.
+        try:
+            bookings = BookingEngine().reserve_many([(self.patient.username, date, vaccine_name)
+                                                     for date, vaccine_name in reservations])
+        except DatabaseError as e:
+            return [failed("Error occurred when making reservation", "Db-Error: " + str(e))] * len(reservations)
+        return [self.wait(self.booked(booking, vaccine_name), booking, date, vaccine_name)
+                for booking, (date, vaccine_name) in zip(bookings, reservations)]
+
+    def reserve_earliest(self, vaccine_name, start):
+        try:
+            booking = BookingEngine().reserve_earliest(self.patient.username, vaccine_name, start)
+        except DatabaseError as e:
+            return failed("Error occurred when making reservation", "Db-Error: " + str(e))
+        if booking.status == BookingResult.NO_CAREGIVER:
+            return failed("No Caregiver is available from " + start.strftime("%m-%d-%Y") + " on!")
+        result = self.booked(booking, vaccine_name)
+        if result.is_ok():
+            result.lines[0] += ", Date: " + booking.get_date().strftime("%m-%d-%Y")
+        return result
+
+    def booked(self, booking, vaccine_name):
+        if booking.status == BookingResult.NO_CAREGIVER:
+            return failed("No Caregiver is available!")
+        if booking.status == BookingResult.NO_VACCINE:
+            return failed("We do not have this vaccine. Please try again!")
+        if booking.status == BookingResult.NO_DOSES:
+            return failed("Not enough available doses!")
+        data = {
+            "appointment_id": booking.get_appointment_id(),
+            "caregiver": booking.get_caregiver(),
+            "slot": booking.get_slot(),
+            "vaccine": vaccine_name,
+            "date": booking.get_date().isoformat(),
+        }
+        return done(f"Appointment ID: {booking.get_appointment_id()}, Caregiver username: {booking.get_caregiver()}",
+                    data=data)
+
+    def wait(self, result, booking, date, vaccine_name):
+        # a reservation that failed for want of a caregiver or doses joins the waitlist
+        if booking.status not in (BookingResult.NO_CAREGIVER, BookingResult.NO_DOSES):
+            return result
+        try:
+            position = WaitlistEngine().add(self.patient.username, date, vaccine_name)
+        except DatabaseError:
+            return result
+        if position is None:
+            # already booked for the vaccine, the patient does not wait for a second appointment
+            return result
+        result.lines.append(f"You are number {position} on the waitlist for {date.strftime('%m-%d-%Y')}, "
+                            "the appointment will be booked as soon as possible.")
+        result.data = {"waitlist_position": position}
+        return result
+
+    def match_waitlist(self, result, dates=(), vaccine_names=()):
+        # books waiting patients on capacity that result brought, noted in result
+        if not result.is_ok():
+            return result
+        try:
+            booked = WaitlistEngine().match(dates, vaccine_names)
+        except DatabaseError:
+            # the entries keep waiting for the next change
+            return result
+        if booked:
+            result.lines.append(f"Booked {len(booked)} appointment(s) for patients on the waitlist!")
+            if isinstance(result.data, dict):
+                result.data["waitlist_booked"] = [booking.get_appointment_id() for _, _, booking in booked]
+        return result
+
+    def upload_availability(self, date, slots=1):
+        try:
+            self.caregiver.upload_availability(date, slots)
+            AvailabilityIndex.get_instance().invalidate(date)
+            CaregiverAssigner.get_instance().release(date, self.caregiver.username)
+        except PoolTimeoutError as e:
+            return failed("Upload Availability Failed", "Db-Error: " + str(e))
+        except DatabaseError as e:
+            return failed("Upload Availability Failed", "Db-Error: " + str(e), fatal=True)
+        except Exception as e:
+            return failed("Error occurred when uploading availability", "Error: " + str(e))
+        return self.match_waitlist(done("Availability uploaded!", data={"dates": [date.date().isoformat()]}), [date])
+
+    def upload_availability_range(self, start_date, end_date, weekdays=None, slots=1):
+        # weekdays is a set of date.weekday() numbers, None for every day
+        if end_date < start_date:
+            return failed("The end date must not be before the start date!")
+        days = (end_date - start_date).days + 1
+        dates = [start_date + datetime.timedelta(days=i) for i in range(days)]
+        dates = [d for d in dates if weekdays is None or d.weekday() in weekdays]
+        try:
+            uploaded = self.caregiver.upload_availabilities(dates, slots)
+            AvailabilityIndex.get_instance().invalidate()
+            CaregiverAssigner.get_instance().invalidate()
+        except PoolTimeoutError as e:
+            return failed("Upload Availability Failed", "Db-Error: " + str(e))
+        except DatabaseError as e:
+            return failed("Upload Availability Failed", "Db-Error: " + str(e), fatal=True)
+        except Exception as e:
+            return failed("Error occurred when uploading availability", "Error: " + str(e))
+        return self.match_waitlist(done(f"Availability uploaded for {uploaded} day(s)!", data={"uploaded": uploaded}),
+                                   dates)
+
+    def upload_availability_batch(self, uploads):
+        # consecutive upload_availability lines of a script as (date, slots) pairs, uploaded
+        # in one transaction. A date that is repeated in the run, already uploaded or fully
+        # booked fails as it would on its own line. Returns one result per line.
+        days = {}
+        for date, slots in uploads:
+            days.setdefault(date.date(), slots)
+        try:
+            inserted = set(self.caregiver.upload_days(days))
+        except PoolTimeoutError as e:
+            return [failed("Upload Availability Failed", "Db-Error: " + str(e))] * len(uploads)
+        except DatabaseError as e:
+            return [failed("Upload Availability Failed", "Db-Error: " + str(e), fatal=True)] * len(uploads)
+        except Exception as e:
+            return [failed("Error occurred when uploading availability", "Error: " + str(e))] * len(uploads)
+        index = AvailabilityIndex.get_instance()
+        assigner = CaregiverAssigner.get_instance()
+        for date in inserted:
+            index.invalidate(date)
+            assigner.release(date, self.caregiver.username)
+        results = []
+        unreported = set(inserted)
+        for date, _ in uploads:
+            if date.date() in unreported:
+                # a later line for the same date finds it uploaded
+                unreported.discard(date.date())
+                results.append(done("Availability uploaded!", data={"dates": [date.date().isoformat()]}))
+            else:
+                results.append(failed("Upload Availability Failed",
+                                      "Error: That day is already uploaded or fully booked!"))
+        uploaded = [result for result in results if result.is_ok()]
+        if uploaded:
+            self.match_waitlist(uploaded[-1], inserted)
+        return results
+
+    def cancel(self, appointment_ids):
+        # appointment_ids may be a single id; ids of other users' appointments are not found
+        if isinstance(appointment_ids, int):
+            appointment_ids = [appointment_ids]
+        try:
+            cancelled = CancellationEngine().cancel(appointment_ids, **self.owner())
+        except DatabaseError:
+            return failed("Data retrieve failed! Please try again!")
+        except Exception as e:
+            return failed("Error occured. Try again! " + str(e))
+        cancelled_ids = [row["AppID"] for row in cancelled]
+        missing = sorted(set(appointment_ids) - set(cancelled_ids))
+        data = {"cancelled": cancelled_ids, "missing": missing}
+        if len(set(appointment_ids)) == 1:
+            if missing:
+                return failed("Sorry, but couldn't find any appointment!")
+            return self.rebook(done("Appointment cancelled succesfully!", data=data), cancelled)
+        lines = [f"Cancelled {len(cancelled_ids)} appointment(s)!"]
+        if missing:
+            lines.append("Sorry, but couldn't find appointment(s): " + ", ".join(str(i) for i in missing))
+        return self.rebook(CommandResult(not missing, lines, data), cancelled)
+
+    def cancel_day(self, date):
+        try:
+            cancelled = CancellationEngine().cancel_day(date, **self.owner())
+        except DatabaseError:
+            return failed("Data retrieve failed! Please try again!")
+        except Exception as e:
+            return failed("Error occured. Try again! " + str(e))
+        if not cancelled:
+            return failed("Sorry, but couldn't find any appointment!")
+        return self.rebook(done(f"Cancelled {len(cancelled)} appointment(s) on {date.strftime('%m-%d-%Y')}!",
+                                data={"cancelled": [row["AppID"] for row in cancelled], "missing": []}), cancelled)
+
+    def rebook(self, result, cancelled):
+        # the doses and slots of cancelled appointments go to the waitlist first
+        return self.match_waitlist(result, {row["Time"] for row in cancelled}, {row["Name"] for row in cancelled})
+
+    def owner(self):
+        if self.patient is not None:
+            return {"patient_username": self.patient.username}
+        return {"caregiver_username": self.caregiver.username}
+
+    def add_doses(self, vaccine_name, doses):
+        # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
+        # else, update the existing entry by adding the new doses
+        try:
+            VaccineInventory.get_instance().add_doses(vaccine_name, doses)
+        except PoolTimeoutError as e:
+            return failed("Error occurred when adding doses", "Db-Error: " + str(e))
+        except DatabaseError as e:
+            return failed("Error occurred when adding doses", "Db-Error: " + str(e), fatal=True)
+        except Exception as e:
+            return failed("Error occurred when adding doses", "Error: " + str(e))
+        return self.match_waitlist(done("Doses updated!", data={"vaccine": vaccine_name, "added": doses}),
+                                   vaccine_names=[vaccine_name])
+
+    def add_doses_batch(self, changes):
+        # consecutive add_doses lines of a script as (vaccine name, doses), added up per
+        # vaccine and applied in one transaction. Returns one result per change.
+        results = [None] * len(changes)
+        totals = {}
+        for i, (vaccine_name, doses) in enumerate(changes):
+            if doses <= 0:
+                results[i] = failed("Error occurred when adding doses", "Error: Argument cannot be negative!")
+            else:
+                totals[vaccine_name] = totals.get(vaccine_name, 0) + doses
+        error = None
+        if totals:
+            try:
+                VaccineInventory.get_instance().add_doses_batch(totals)
+            except PoolTimeoutError as e:
+                error = failed("Error occurred when adding doses", "Db-Error: " + str(e))
+            except DatabaseError as e:
+                error = failed("Error occurred when adding doses", "Db-Error: " + str(e), fatal=True)
+            except Exception as e:
+                error = failed("Error occurred when adding doses", "Error: " + str(e))
+        for i, (vaccine_name, doses) in enumerate(changes):
+            if results[i] is None:
+                results[i] = error or done("Doses updated!", data={"vaccine": vaccine_name, "added": doses})
+        if totals and error is None:
+            self.match_waitlist([result for result in results if result.is_ok()][-1], vaccine_names=totals)
+        return results
+
+    def show_appointments(self, from_date=None, limit=None, after_id=None):
+        # one page of the user's appointments in AppID order, read by consume() of the
+        # returned listing; after_id is the last AppID of the previous page
+        if self.patient is not None:
+            username, other = self.patient.username, "c_username"
+            sql = "SELECT {}AppID, Name, Time, c_username FROM Appointments WHERE p_username = %s"
+        else:
+            username, other = self.caregiver.username, "p_username"
+            sql = "SELECT {}AppID, Name, Time, p_username FROM Appointments WHERE c_username = %s"
+        params = [username]
+        if from_date is not None:
+            sql += " AND Time >= %s"
+            params.append(from_date)
+        if after_id is not None:
+            sql += " AND AppID > %d"
+            params.append(after_id)
+        sql += " ORDER BY AppID"
+        top = ""
+        if limit is not None:
+            if ConnectionManager.get_backend().name == "mssql":
+                top = "TOP (%d) "
+                params.insert(0, limit)
+            else:
+                sql += " LIMIT %d"
+                params.append(limit)
+        return AppointmentListing(sql.format(top), tuple(params), other, limit)
+
+    def logout(self):
+        self.patient = None
+        self.caregiver = None
+        return done("Successfully logged out!")
+
+
+def extract_date(date_token):
+    # dates are typed as mm-dd-yyyy
+    date_tokens = date_token.split("-")
+    return datetime.datetime(int(date_tokens[2]), int(date_tokens[0]), int(date_tokens[1]))
+
+
+def split_slots(tokens):
+    # takes a trailing --slots <n> off tokens; returns the other tokens and n, 1 without it
+    if len(tokens) > 2 and tokens[-2] == "--slots":
+        slots = int(tokens[-1])
+        Slots.full(slots)
+        return tokens[:-2], slots
+    return tokens, 1
+
+
+def password_problem(password):
+    # returns why the password is too weak, or None if it is strong enough
+    if len(password) < 8:
+        return "Password must be at least 8 characters"
+    if not any(char.isupper() for char in password) or not any(char.islower() for char in password):
+        return "Password must be a mixture of both uppercase and lowercase letters."
+    if not any(char.isdigit() for char in password):
+        return "Password must be a mixture of letters and numbers."
+    if not any(char in '!@#?' for char in password):
+        return "Password must contain at least one special character from !, @, #, ?."
+    return None
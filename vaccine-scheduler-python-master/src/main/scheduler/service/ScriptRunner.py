@@ -0,0 +1,81 @@
+import json
+from service.SchedulerSession import CommandResult
+from util.Metrics import Metrics
+
+
+class ScriptRunner:
+    '''
+    Runs a script of scheduler commands, one command per line, for a single
+    session and writes one JSON object per command:
+        {"line": 12, "command": "reserve", "ok": true, "lines": [...], "data": {...}}
+    followed by a summary object. Lines are read as they come, so scripts of any
+    length run in constant memory. Runs of consecutive add_doses,
+    upload_availability or reserve lines (up to batch_size) are written in one
+    transaction each. Failed commands, including database errors, are reported
+    and the script goes on; quit ends it. Blank lines and lines starting with #
+    are skipped.
+    '''
+
+    # command -> SchedulerSession method that runs a run of them at once
+    BATCHED = {
+        "add_doses": "add_doses_batch",
+        "upload_availability": "upload_availability_batch",
+        "reserve": "reserve_batch",
+    }
+
+    def __init__(self, session, out, batch_size=1000):
+        self.session = session
+        self.out = out
+        self.batch_size = batch_size
+        self.pending = []
+        self.commands = 0
+        self.failed = 0
+
+    def run(self, lines):
+        for number, line in enumerate(lines, 1):
+            line = line.rstrip("\r\n")
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            tokens = line.split(" ")
+            operation = tokens[0]
+            if operation in self.BATCHED:
+                if self.pending and (self.pending[0][1] != operation or len(self.pending) >= self.batch_size):
+                    self.flush()
+                # login and arguments are checked now; nothing in a run can change the login
+                self.pending.append((number, operation, self.session.parse(operation, tokens)))
+                continue
+            self.flush()
+            result = self.session.execute(tokens)
+            self.emit(number, operation, result)
+            if result.stop:
+                break
+        self.flush()
+        self.write({"summary": {"commands": self.commands, "ok": self.commands - self.failed,
+                                "failed": self.failed}})
+        return self.failed
+
+    def flush(self):
+        if not self.pending:
+            return
+        operation = self.pending[0][1]
+        valid = [parsed[1] for _, _, parsed in self.pending if not isinstance(parsed, CommandResult)]
+        results = []
+        if valid:
+            method = getattr(self.session, self.BATCHED[operation])
+            with Metrics.get_instance().command(operation + "_batch"):
+                results = method(valid)
+        results = iter(results)
+        for number, operation, parsed in self.pending:
+            self.emit(number, operation, parsed if isinstance(parsed, CommandResult) else next(results))
+        self.pending = []
+
+    def emit(self, number, operation, result):
+        self.commands += 1
+        if not result.is_ok():
+            self.failed += 1
+        entry = {"line": number, "command": operation}
+        entry.update(result.to_dict())
+        self.write(entry)
+
+    def write(self, entry):
+        self.out.write(json.dumps(entry, default=str) + "\n")
@@ -0,0 +1,140 @@
+import sys
+sys.path.append("../model/*")
+from model.Vaccine import Vaccine
+from db.ConnectionManager import ConnectionManager
+import os
+import threading
+import time
+from db.Backend import IntegrityError
+from db.Batch import MAX_ROWS_PER_STATEMENT, chunks, insert_rows, select_existing
+
+
+class VaccineInventory:
+    '''
+    In-memory copy of the Vaccines table shared by the whole process.
+    Reads are served from memory and the table is reloaded at most every ttl
+    seconds. Dose changes are applied in the database as relative deltas and the
+    returned row is written through to the cache; every change bumps the row's
+    Version, so a slower reader can never overwrite a newer value it did not see.
+    The cache never decides a reservation: it may only let one through to the
+    guarded database decrement, and an empty or missing vaccine is re-read from
+    the database before a patient is turned away.
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, ttl=5):
+        self.ttl = ttl
+        self.vaccines = {}
+        self.loaded_at = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    cls.instance = cls(float(os.getenv("InventoryTTL", "5")))
+        return cls.instance
+
+    def get_all(self):
+        self.refresh_if_stale()
+        with self.lock:
+            return sorted(self.vaccines.values(), key=lambda vaccine: vaccine.get_vaccine_name())
+
+    def get(self, vaccine_name):
+        self.refresh_if_stale()
+        with self.lock:
+            return self.vaccines.get(vaccine_name)
+
+    def get_in_stock(self, vaccine_name):
+        # like get(), but confirms a missing or empty vaccine against the database
+        vaccine = self.get(vaccine_name)
+        if vaccine is not None and vaccine.get_available_doses() > 0:
+            return vaccine
+        vaccine = Vaccine(vaccine_name, None).get()
+        if vaccine is None:
+            self.invalidate(vaccine_name)
+        else:
+            self.apply(vaccine)
+        return vaccine
+
+    def add_doses(self, vaccine_name, num):
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+        vaccine = Vaccine(vaccine_name, num)
+        try:
+            vaccine.increase_available_doses(num)
+        except ValueError:
+            # the vaccine does not exist yet
+            try:
+                vaccine.save_to_db()
+            except IntegrityError:
+                # someone else created it in the meantime
+                vaccine.increase_available_doses(num)
+        self.apply(vaccine)
+        return vaccine
+
+    def add_doses_batch(self, doses):
+        # adds {vaccine name: doses} in one transaction, returns the updated vaccines
+        if any(num <= 0 for num in doses.values()):
+            raise ValueError("Argument cannot be negative!")
+        add_doses = "UPDATE Vaccines SET Doses = Doses + %d, Version = Version + 1 WHERE Name = %s"
+        get_vaccines = "SELECT Name, Doses, Version FROM Vaccines WHERE Name IN ({})"
+        for attempt in range(2):
+            vaccines = []
+            try:
+                with ConnectionManager() as conn:
+                    cursor = conn.cursor()
+                    existing = select_existing(cursor, "SELECT Name FROM Vaccines WHERE Name IN ({})", doses)
+                    for name in existing:
+                        cursor.execute(add_doses, (doses[name], name))
+                    insert_rows(cursor, "Vaccines", ("Name", "Doses", "Version"),
+                                [(name, num, 0) for name, num in doses.items() if name not in existing])
+                    for chunk in chunks(list(doses), MAX_ROWS_PER_STATEMENT):
+                        cursor.execute(get_vaccines.format(", ".join(["%s"] * len(chunk))), tuple(chunk))
+                        vaccines.extend(Vaccine(name, num, version) for name, num, version in cursor)
+                    conn.commit()
+                break
+            except IntegrityError:
+                # someone else created one of the new vaccines in the meantime, it is an update now
+                if attempt == 1:
+                    raise
+        for vaccine in vaccines:
+            self.apply(vaccine)
+        return vaccines
+
+    def apply(self, vaccine):
+        with self.lock:
+            current = self.vaccines.get(vaccine.get_vaccine_name())
+            if current is None or current.get_version() is None or vaccine.get_version() is None \
+                    or vaccine.get_version() >= current.get_version():
+                self.vaccines[vaccine.get_vaccine_name()] = vaccine
+
+    def invalidate(self, vaccine_name=None):
+        with self.lock:
+            if vaccine_name is None:
+                self.loaded_at = None
+            else:
+                self.vaccines.pop(vaccine_name, None)
+
+    def refresh_if_stale(self):
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= self.ttl:
+            self.refresh()
+
+    def refresh(self):
+        get_vaccines = "SELECT Name, Doses, Version FROM Vaccines"
+        started = time.monotonic()
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(get_vaccines)
+            vaccines = [Vaccine(name, doses, version) for name, doses, version in cursor]
+        names = {vaccine.get_vaccine_name() for vaccine in vaccines}
+        with self.lock:
+            for name in list(self.vaccines):
+                if name not in names:
+                    del self.vaccines[name]
+        for vaccine in vaccines:
+            self.apply(vaccine)
+        self.loaded_at = started
@@ -0,0 +1,202 @@
+from db.ConnectionManager import ConnectionManager
+from db.Backend import IntegrityError
+from db.Batch import MAX_ROWS_PER_STATEMENT, chunks
+from service.BookingEngine import BookingEngine
+from service.IdAllocator import IdAllocator
+from service.CaregiverAssigner import as_date
+import datetime
+import os
+
+
+class WaitlistConflict(Exception):
+    # another matching pass booked some of the same entries first
+    pass
+
+
+class WaitlistEngine:
+    '''
+    Persistent waitlist of reservations that failed for want of a caregiver or
+    doses. Whenever capacity arrives (doses added, availability uploaded,
+    appointments cancelled) match() books the waiting entries of the affected
+    vaccines or days oldest first with BookingEngine.reserve_many, and deletes
+    the entries it booked in the same transaction. Entries that still cannot be
+    booked keep their place in the queue. A patient waits at most once per day
+    and vaccine (a unique index guards it), and not at all for a vaccine they
+    already have an upcoming appointment for.
+    A pass books at most one appointment per patient and vaccine: their oldest
+    entry that can be booked, and the transaction that books it deletes their
+    other entries for the vaccine. Entries for days that have passed, and those of
+    patients who have since got an appointment for the vaccine on some day, are
+    dropped when their vaccine or day is matched; entries for days without
+    caregivers or vaccines without doses are not read at all.
+    '''
+
+    add_entry = """
+        INSERT INTO Waitlist (WaitID, p_username, Time, Name)
+        SELECT %d, %s, %s, %s
+        WHERE NOT EXISTS (SELECT 1 FROM Waitlist WHERE p_username = %s AND Time = %s AND Name = %s)
+          AND NOT EXISTS (SELECT 1 FROM Appointments WHERE p_username = %s AND Name = %s AND Time >= %s)
+    """
+
+    get_position = """
+        SELECT COUNT(*) FROM Waitlist
+        WHERE Time = %s AND Name = %s AND WaitID <= (SELECT WaitID FROM Waitlist
+                                                     WHERE p_username = %s AND Time = %s AND Name = %s)
+    """
+
+    # waiting entries that can no longer be wanted
+    purge_entries = """
+        DELETE FROM Waitlist WHERE ({conditions}) AND (Time < %s OR EXISTS (
+            SELECT 1 FROM Appointments a WHERE a.p_username = Waitlist.p_username AND a.Name = Waitlist.Name
+                                           AND a.Time >= %s))
+    """
+
+    # waiting entries that might be booked: a caregiver is free that day and the vaccine has doses
+    get_entries = """
+        SELECT {top}WaitID, p_username, Time, Name FROM Waitlist
+        WHERE WaitID > %d AND Time >= %s AND ({conditions})
+          AND EXISTS (SELECT 1 FROM Availabilities v WHERE v.Time = Waitlist.Time)
+          AND EXISTS (SELECT 1 FROM Vaccines x WHERE x.Name = Waitlist.Name AND x.Doses > 0)
+        ORDER BY WaitID{limit}
+    """
+
+    def __init__(self, engine=None, id_allocator=None, batch_size=None):
+        self.engine = engine or BookingEngine()
+        self.id_allocator = id_allocator or IdAllocator.for_waitlist()
+        self.batch_size = batch_size or int(os.getenv("WaitlistBatchSize", "1000"))
+
+    def add(self, patient_username, date, vaccine_name):
+        # queues the reservation unless the patient already waits for it; returns the
+        # patient's place among those waiting for that day and vaccine, or None if they
+        # have an upcoming appointment for the vaccine and are not queued
+        date = as_date(date)
+        key = (patient_username, date, vaccine_name)
+        # the id is taken before the connection, it may need a connection of its own
+        wait_id = self.id_allocator.next_id()
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(self.add_entry, (wait_id,) + key + key
+                               + (patient_username, vaccine_name, datetime.date.today()))
+                conn.commit()
+            except IntegrityError:
+                # a concurrent add queued the same reservation first
+                conn.rollback()
+            cursor.execute(self.get_position, (date, vaccine_name) + key)
+            position = cursor.fetchone()[0]
+        return position or None
+
+    def match(self, dates=(), vaccine_names=()):
+        # books waiting entries for any of dates or vaccine_names, oldest first, up to
+        # batch_size per transaction; returns [(WaitID, patient_username, BookingResult)]
+        # of the entries that were booked
+        dates = sorted({as_date(date) for date in dates})
+        vaccine_names = sorted(set(vaccine_names))
+        if not dates and not vaccine_names:
+            return []
+        self.purge(dates, vaccine_names)
+        booked = []
+        # (patient_username, vaccine_name) booked by this pass
+        taken = set()
+        after_id = 0
+        conflicts = 0
+        while True:
+            entries = self.get_waiting(dates, vaccine_names, after_id)
+            if not entries:
+                break
+            try:
+                self.book(entries, taken, booked)
+            except WaitlistConflict:
+                # read the queue again, giving up after a few lost races
+                conflicts += 1
+                if conflicts > 3:
+                    break
+                continue
+            if len(entries) < self.batch_size:
+                break
+            after_id = entries[-1][0]
+        return booked
+
+    def book(self, entries, taken, booked):
+        # books entries, at most one per patient and vaccine: a patient's later entries for
+        # a vaccine are tried only if the earlier ones could not be booked, and deleted with
+        # the booking once one is
+        while entries:
+            batch = []
+            later = []
+            keys = set()
+            for entry in entries:
+                key = (entry[1], entry[3])
+                if key not in taken:
+                    (later if key in keys else batch).append(entry)
+                    keys.add(key)
+            dropped = [entry for entry in entries if (entry[1], entry[3]) in taken]
+            if not batch:
+                with ConnectionManager() as conn:
+                    self.delete(conn.cursor(), [entry[0] for entry in dropped])
+                    conn.commit()
+                return
+
+            def before_commit(cursor, results):
+                self.remove(cursor, batch, results)
+                now_taken = taken | {(entry[1], entry[3]) for entry, result in zip(batch, results)
+                                     if result.is_booked()}
+                self.delete(cursor, [entry[0] for entry in dropped + later if (entry[1], entry[3]) in now_taken])
+
+            results = self.engine.reserve_many([entry[1:] for entry in batch], before_commit)
+            for entry, result in zip(batch, results):
+                if result.is_booked():
+                    taken.add((entry[1], entry[3]))
+                    booked.append((entry[0], entry[1], result))
+            entries = [entry for entry in later if (entry[1], entry[3]) not in taken]
+
+    def purge(self, dates, vaccine_names):
+        # drops the entries for dates or vaccine_names that are past or already booked
+        conditions, params = self.conditions(dates, vaccine_names)
+        today = datetime.date.today()
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(self.purge_entries.format(conditions=conditions), tuple(params) + (today, today))
+            conn.commit()
+
+    def get_waiting(self, dates, vaccine_names, after_id):
+        # the oldest batch_size bookable entries after after_id waiting for one of dates or vaccine_names
+        conditions, params = self.conditions(dates, vaccine_names)
+        params = [after_id, datetime.date.today()] + params
+        if ConnectionManager.get_backend().name == "mssql":
+            sql = self.get_entries.format(top="TOP (%d) ", conditions=conditions, limit="")
+            params.insert(0, self.batch_size)
+        else:
+            sql = self.get_entries.format(top="", conditions=conditions, limit=" LIMIT %d")
+            params.append(self.batch_size)
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, tuple(params))
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def conditions(self, dates, vaccine_names):
+        # "Time IN (...) OR Name IN (...)" and its parameters
+        conditions = []
+        params = []
+        if dates:
+            conditions.append("Time IN ({})".format(", ".join(["%s"] * len(dates))))
+            params.extend(dates)
+        if vaccine_names:
+            conditions.append("Name IN ({})".format(", ".join(["%s"] * len(vaccine_names))))
+            params.extend(vaccine_names)
+        return " OR ".join(conditions), params
+
+    def remove(self, cursor, entries, results):
+        # deletes the booked entries within the booking transaction
+        ids = [entry[0] for entry, result in zip(entries, results) if result.is_booked()]
+        if self.delete(cursor, ids) != len(ids):
+            raise WaitlistConflict()
+
+    def delete(self, cursor, ids):
+        # deletes the entries with the given WaitIDs, returns how many there were
+        removed = 0
+        for chunk in chunks(ids, MAX_ROWS_PER_STATEMENT):
+            cursor.execute("DELETE FROM Waitlist WHERE WaitID IN ({})".format(", ".join(["%d"] * len(chunk))),
+                           tuple(chunk))
+            removed += cursor.rowcount
+        return removed
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+
+class CredentialCache:
+    '''
+    In-process cache of credential rows (Salt, Hash, PasswordHash) keyed by
+    (table, username), bounded by size (least recently used entries go first)
+    and by age. After a successful login the entry also remembers an HMAC of
+    the password under a per-process random key for a short time, so the same
+    client logging in again skips both the database and the password hash.
+    Entries must be invalidated whenever a user's credentials are written.
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, max_size=10000, ttl=300, verified_ttl=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.verified_ttl = verified_ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.key = os.urandom(32)
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    cls.instance = cls(int(os.getenv("CredentialCacheSize", "10000")),
+                                       float(os.getenv("CredentialCacheTTL", "300")),
+                                       float(os.getenv("VerifiedLoginTTL", "60")))
+        return cls.instance
+
+    def get_row(self, table, username):
+        with self.lock:
+            entry = self._lookup(table, username)
+            return None if entry is None else entry["row"]
+
+    def put_row(self, table, username, row):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[(table, username)] = {"row": row, "loaded": time.monotonic(),
+                                               "verified": None, "verified_at": 0}
+            self.entries.move_to_end((table, username))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, table, username):
+        with self.lock:
+            self.entries.pop((table, username), None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def get_verified(self, table, username, password):
+        # returns the cached row if this password was verified for the user recently
+        digest = self._digest(username, password)
+        with self.lock:
+            entry = self._lookup(table, username)
+            if entry is None or entry["verified"] is None:
+                return None
+            if time.monotonic() - entry["verified_at"] >= self.verified_ttl:
+                entry["verified"] = None
+                return None
+            return entry["row"] if hmac.compare_digest(entry["verified"], digest) else None
+
+    def mark_verified(self, table, username, password):
+        digest = self._digest(username, password)
+        with self.lock:
+            entry = self.entries.get((table, username))
+            if entry is not None:
+                entry["verified"] = digest
+                entry["verified_at"] = time.monotonic()
+
+    def _lookup(self, table, username):
+        entry = self.entries.get((table, username))
+        if entry is None:
+            return None
+        if time.monotonic() - entry["loaded"] >= self.ttl:
+            del self.entries[(table, username)]
+            return None
+        self.entries.move_to_end((table, username))
+        return entry
+
+    def _digest(self, username, password):
+        return hmac.new(self.key, (username + "\0" + password).encode('utf-8'), hashlib.sha256).digest()
@@ -0,0 +1,94 @@
+from util.Util import Util
+from util.PasswordHasher import PasswordHasher
+from util.Metrics import Metrics
+from concurrent.futures import Future, ProcessPoolExecutor
+import asyncio
+import atexit
+import hmac
+import multiprocessing
+import os
+import threading
+
+
+class HashService:
+    '''
+    Runs password hashing in a pool of worker processes so that hashing for many
+    sessions proceeds in parallel across cores instead of serially.
+    With workers=0 hashes are computed inline in the calling thread.
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    def __init__(self, workers=None):
+        self.workers = os.cpu_count() if workers is None else workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    workers = os.getenv("HashWorkers")
+                    cls.instance = cls(int(workers) if workers else None)
+                    atexit.register(cls.instance.shutdown)
+        return cls.instance
+
+    def submit(self, fn, *args):
+        if self.workers == 0:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        return self.get_executor().submit(fn, *args)
+
+    def run(self, fn, *args):
+        with Metrics.kdf():
+            return self.submit(fn, *args).result()
+
+    async def run_async(self, fn, *args):
+        with Metrics.kdf():
+            return await asyncio.wrap_future(self.submit(fn, *args))
+
+    # legacy PBKDF2 hash of the Salt/Hash columns
+    def generate_hash(self, password, salt):
+        return self.run(Util.generate_hash, password, salt)
+
+    async def generate_hash_async(self, password, salt):
+        return await self.run_async(Util.generate_hash, password, salt)
+
+    def hash_password(self, password):
+        return self.run(PasswordHasher.hash_password, password, PasswordHasher.current_scheme())
+
+    def verify_password(self, password, encoded):
+        return self.run(PasswordHasher.verify_password, password, encoded)
+
+    def check_credentials(self, password, salt, hash, encoded):
+        # returns (matches, new PasswordHash to store or None); users still on the
+        # legacy Salt/Hash columns or on an outdated scheme are upgraded on login
+        if encoded is None:
+            matches = hash is not None and hmac.compare_digest(self.generate_hash(password, salt), hash)
+        else:
+            matches = self.verify_password(password, encoded)
+        if matches and (encoded is None or PasswordHasher.needs_rehash(encoded, PasswordHasher.current_scheme())):
+            return True, self.hash_password(password)
+        return matches, None
+
+    def get_executor(self):
+        # the worker processes are started on first use, not at import time, and are
+        # spawned rather than forked since forking a threaded process (e.g. the server) can deadlock
+        if self.executor is None:
+            with self.lock:
+                if self.executor is None:
+                    self.executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                        mp_context=multiprocessing.get_context("spawn"))
+        return self.executor
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
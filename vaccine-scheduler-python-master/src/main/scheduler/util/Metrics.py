@@ -0,0 +1,214 @@
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+
+# trace of the command running in the current thread or asyncio task
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class CommandTrace:
+    '''
+    What one command did: connections checked out of the pool (and how many of
+    them had to be newly opened), queries sent, rows fetched, and the time spent
+    waiting on the database and on password hashing.
+    '''
+
+    def __init__(self, command):
+        self.command = command
+        self.started = time.perf_counter()
+        self.duration = 0.0
+        self.connections = 0
+        self.new_connections = 0
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.kdf_seconds = 0.0
+        self.error = None
+
+    def add_connection(self, new):
+        self.connections += 1
+        if new:
+            self.new_connections += 1
+
+    def add_query(self, seconds):
+        self.queries += 1
+        self.db_seconds += seconds
+
+    def add_rows(self, count, seconds=0.0):
+        self.rows += count
+        self.db_seconds += seconds
+
+    def add_kdf(self, seconds):
+        self.kdf_seconds += seconds
+
+    def to_dict(self):
+        return {
+            "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+            "command": self.command,
+            "ms": round(self.duration * 1000, 3),
+            "connections": self.connections,
+            "new_connections": self.new_connections,
+            "queries": self.queries,
+            "rows": self.rows,
+            "db_ms": round(self.db_seconds * 1000, 3),
+            "kdf_ms": round(self.kdf_seconds * 1000, 3),
+            "error": self.error,
+        }
+
+
+class CommandStats:
+    def __init__(self, buckets):
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.connections = 0
+        self.new_connections = 0
+        self.queries = 0
+        self.rows = 0
+        self.db_seconds = 0.0
+        self.kdf_seconds = 0.0
+
+
+class Metrics:
+    '''
+    Per-command instrumentation. Every command runs inside command(name), which
+    traces it and then adds the trace to per-command totals and a latency
+    histogram, rendered in the Prometheus text format by render().
+    MetricsPort serves that text over HTTP at /metrics, and TraceLog names a file
+    that gets one JSON line per command.
+    '''
+
+    instance = None
+    instance_lock = threading.Lock()
+
+    BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self, trace_path=None):
+        self.stats = {}
+        self.lock = threading.Lock()
+        self.trace_path = trace_path
+        self.trace_file = None
+        self.server = None
+
+    @classmethod
+    def get_instance(cls):
+        if cls.instance is None:
+            with cls.instance_lock:
+                if cls.instance is None:
+                    cls.instance = cls(os.getenv("TraceLog"))
+                    port = os.getenv("MetricsPort")
+                    if port:
+                        cls.instance.serve(int(port))
+        return cls.instance
+
+    @staticmethod
+    def current():
+        return current_trace.get()
+
+    @staticmethod
+    @contextmanager
+    def kdf():
+        # times a password hash computed, or waited for, by the current command
+        trace = current_trace.get()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if trace is not None:
+                trace.add_kdf(time.perf_counter() - start)
+
+    @contextmanager
+    def command(self, name):
+        trace = CommandTrace(name)
+        token = current_trace.set(trace)
+        try:
+            yield trace
+        except BaseException as e:
+            trace.error = type(e).__name__
+            raise
+        finally:
+            trace.duration = time.perf_counter() - trace.started
+            current_trace.reset(token)
+            self.record(trace)
+
+    def record(self, trace):
+        with self.lock:
+            stats = self.stats.get(trace.command)
+            if stats is None:
+                stats = self.stats[trace.command] = CommandStats(self.BUCKETS)
+            for i, bound in enumerate(self.BUCKETS):
+                if trace.duration <= bound:
+                    stats.bucket_counts[i] += 1
+            stats.count += 1
+            stats.errors += trace.error is not None
+            stats.seconds += trace.duration
+            stats.connections += trace.connections
+            stats.new_connections += trace.new_connections
+            stats.queries += trace.queries
+            stats.rows += trace.rows
+            stats.db_seconds += trace.db_seconds
+            stats.kdf_seconds += trace.kdf_seconds
+            if self.trace_path:
+                if self.trace_file is None:
+                    self.trace_file = open(self.trace_path, "a")
+                self.trace_file.write(json.dumps(trace.to_dict()) + "\n")
+                self.trace_file.flush()
+
+    def render(self):
+        with self.lock:
+            stats = sorted(self.stats.items())
+            lines = [
+                "# HELP scheduler_command_duration_seconds Wall time of scheduler commands.",
+                "# TYPE scheduler_command_duration_seconds histogram",
+            ]
+            for command, s in stats:
+                for bound, count in zip(self.BUCKETS, s.bucket_counts):
+                    lines.append('scheduler_command_duration_seconds_bucket{command="%s",le="%s"} %d'
+                                 % (command, bound, count))
+                lines.append('scheduler_command_duration_seconds_bucket{command="%s",le="+Inf"} %d'
+                             % (command, s.count))
+                lines.append('scheduler_command_duration_seconds_sum{command="%s"} %r' % (command, s.seconds))
+                lines.append('scheduler_command_duration_seconds_count{command="%s"} %d' % (command, s.count))
+            counters = [
+                ("errors", "Commands that raised an exception.", "errors"),
+                ("connections", "Connections checked out of the pool.", "connections"),
+                ("new_connections", "Database connections opened.", "new_connections"),
+                ("queries", "Queries sent to the database.", "queries"),
+                ("rows", "Rows fetched from the database.", "rows"),
+                ("db_seconds", "Time spent executing queries and fetching rows.", "db_seconds"),
+                ("kdf_seconds", "Time spent hashing passwords.", "kdf_seconds"),
+            ]
+            for name, help_text, field in counters:
+                lines.append("# HELP scheduler_command_%s_total %s" % (name, help_text))
+                lines.append("# TYPE scheduler_command_%s_total counter" % name)
+                for command, s in stats:
+                    lines.append('scheduler_command_%s_total{command="%s"} %r' % (name, command, getattr(s, field)))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
@@ -0,0 +1,85 @@
+import base64
+import hashlib
+import hmac
+import os
+
+try:
+    import argon2
+except ImportError:
+    argon2 = None
+
+
+class PasswordHasher:
+    '''
+    Self-describing password hashes, stored in the PasswordHash column:
+        pbkdf2_sha256$i=<iterations>,l=<key length>$<salt>$<key>
+        scrypt$n=<cost>,r=<block size>,p=<parallelism>,l=<key length>$<salt>$<key>
+        $argon2id$...   (argon2-cffi's own encoding, when argon2-cffi is installed)
+    Salt and key are base64. The scheme for new hashes comes from HashAlgorithm,
+    HashIterations, HashKeyLength and ScryptN/ScryptR/ScryptP; hashes made with a
+    different scheme still verify, and needs_rehash() reports them for upgrade.
+    '''
+
+    DEFAULT_ITERATIONS = 100000
+    DEFAULT_KEY_LENGTH = 32
+
+    def current_scheme():
+        algorithm = os.getenv("HashAlgorithm", "pbkdf2_sha256")
+        key_length = int(os.getenv("HashKeyLength", str(PasswordHasher.DEFAULT_KEY_LENGTH)))
+        if algorithm == "pbkdf2_sha256":
+            iterations = int(os.getenv("HashIterations", str(PasswordHasher.DEFAULT_ITERATIONS)))
+            return f"pbkdf2_sha256$i={iterations},l={key_length}"
+        if algorithm == "scrypt":
+            n = int(os.getenv("ScryptN", "16384"))
+            r = int(os.getenv("ScryptR", "8"))
+            p = int(os.getenv("ScryptP", "1"))
+            return f"scrypt$n={n},r={r},p={p},l={key_length}"
+        if algorithm == "argon2":
+            if argon2 is None:
+                raise ValueError("HashAlgorithm argon2 requires the argon2-cffi package")
+            return "argon2"
+        raise ValueError("Unknown HashAlgorithm: " + algorithm)
+
+    def hash_password(password, scheme):
+        if scheme == "argon2":
+            return argon2.PasswordHasher().hash(password)
+        algorithm, params = scheme.split("$")
+        salt = os.urandom(16)
+        key = PasswordHasher.derive(password, salt, algorithm, PasswordHasher.parse_params(params))
+        return "$".join([algorithm, params, PasswordHasher.b64encode(salt), PasswordHasher.b64encode(key)])
+
+    def verify_password(password, encoded):
+        if encoded.startswith("$argon2"):
+            if argon2 is None:
+                raise ValueError("Verifying argon2 hashes requires the argon2-cffi package")
+            try:
+                return argon2.PasswordHasher().verify(encoded, password)
+            except argon2.exceptions.VerificationError:
+                return False
+        algorithm, params, salt, key = encoded.split("$")
+        calculated = PasswordHasher.derive(password, PasswordHasher.b64decode(salt), algorithm,
+                                           PasswordHasher.parse_params(params))
+        return hmac.compare_digest(calculated, PasswordHasher.b64decode(key))
+
+    def needs_rehash(encoded, scheme):
+        if encoded.startswith("$argon2"):
+            return scheme != "argon2" or argon2.PasswordHasher().check_needs_rehash(encoded)
+        return not encoded.startswith(scheme + "$")
+
+    def derive(password, salt, algorithm, params):
+        if algorithm == "pbkdf2_sha256":
+            return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, params["i"], dklen=params["l"])
+        if algorithm == "scrypt":
+            n, r, p = params["n"], params["r"], params["p"]
+            return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, dklen=params["l"],
+                                  maxmem=256 * n * r + (1 << 20))
+        raise ValueError("Unknown password hash algorithm: " + algorithm)
+
+    def parse_params(params):
+        return {name: int(value) for name, value in (item.split("=") for item in params.split(","))}
+
+    def b64encode(raw):
+        return base64.b64encode(raw).decode('ascii')
+
+    def b64decode(text):
+        return base64.b64decode(text.encode('ascii'))
@@ -0,0 +1,57 @@
+from db.ConnectionManager import ConnectionManager
+
+# A caregiver's day is split into numbered time slots. Availabilities.Slots holds
+# the free ones as a bitmap, bit i set = slot i free, and Appointments.Slot the
+# slot an appointment holds. Slots fit a signed 32 bit int column, so at most 31.
+MAX_SLOTS = 31
+
+
+def full(count):
+    # bitmap of slots 0 .. count - 1
+    if not 1 <= count <= MAX_SLOTS:
+        raise ValueError("A day has between 1 and {} slots!".format(MAX_SLOTS))
+    return (1 << count) - 1
+
+
+def bit(slot):
+    return 1 << slot
+
+
+def lowest(bitmap):
+    # number of the first free slot, the one a reservation takes
+    return (bitmap & -bitmap).bit_length() - 1
+
+
+def count(bitmap):
+    return bin(bitmap).count("1")
+
+
+def union(bitmaps):
+    # slots free with at least one of the caregivers
+    result = 0
+    for bitmap in bitmaps:
+        result |= bitmap
+    return result
+
+
+def slots_of(bitmap):
+    return [slot for slot in range(MAX_SLOTS) if bitmap & (1 << slot)]
+
+
+def describe(bitmap):
+    # "0-3,5" style list of the slots in bitmap
+    ranges = []
+    for slot in slots_of(bitmap):
+        if ranges and ranges[-1][1] == slot - 1:
+            ranges[-1][1] = slot
+        else:
+            ranges.append([slot, slot])
+    return ",".join(str(a) if a == b else "{}-{}".format(a, b) for a, b in ranges)
+
+
+def bit_sql(column):
+    # SQL expression for the bit of the slot number in column
+    if ConnectionManager.get_backend().name == "mssql":
+        return "POWER(2, {})".format(column)
+    return "(1 << {})".format(column)
+
@@ -0,0 +1,112 @@
+'''
+Shared setup of the scheduler tests: puts src/main/scheduler on the import path
+and gives every test its own SQLite database, created from create.sql and the
+migrations, with the process-wide caches and id allocators reset.
+
+Run from the repository root:
+    python -m unittest discover -s src/test/scheduler
+'''
+import datetime
+import os
+import sys
+import tempfile
+import unittest
+
+SCHEDULER_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                              "..", "..", "main", "scheduler"))
+if SCHEDULER_DIR not in sys.path:
+    sys.path.insert(0, SCHEDULER_DIR)
+os.environ.setdefault("HashWorkers", "0")
+os.environ.setdefault("HashIterations", "1000")
+
+from db.Backend import SqliteBackend
+from db.Batch import insert_rows
+from db.ConnectionManager import ConnectionManager
+from db.Migrator import Migrator
+from model.Caregiver import Caregiver
+from model.Patient import Patient
+from service.AvailabilityIndex import AvailabilityIndex
+from service.CaregiverAssigner import CaregiverAssigner
+from service.IdAllocator import IdAllocator
+from service.ReservationCoordinator import ReservationCoordinator
+from service.SchedulerSession import SchedulerSession
+from service.VaccineInventory import VaccineInventory
+from util.CredentialCache import CredentialCache
+
+# waitlist entries before today are dropped, so tests book days to come
+START_DATE = datetime.date.today() + datetime.timedelta(days=30)
+
+
+def day(offset):
+    return START_DATE + datetime.timedelta(days=offset)
+
+
+def format_date(date):
+    return date.strftime("%m-%d-%Y")
+
+
+def reset_singletons():
+    for cls in (AvailabilityIndex, CaregiverAssigner, CredentialCache, ReservationCoordinator, VaccineInventory):
+        cls.instance = None
+    IdAllocator.appointments = None
+    IdAllocator.waitlist = None
+
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.backend = SqliteBackend(os.path.join(directory.name, "test.db"))
+        self.use_pool()
+        self.addCleanup(ConnectionManager.use_backend, None)
+        self.addCleanup(reset_singletons)
+        migrator = Migrator()
+        migrator.create_schema()
+        migrator.migrate()
+
+    def use_pool(self):
+        # a fresh pool and fresh caches, configured from the environment as it is now
+        reset_singletons()
+        ConnectionManager.use_backend(self.backend)
+
+    def seed(self, patients=(), caregivers=(), availabilities=None, vaccines=None):
+        # availabilities is {(date, caregiver): slots bitmap}, vaccines {name: doses}
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            insert_rows(cursor, "Patients", ("Username",), [(name,) for name in patients])
+            insert_rows(cursor, "Caregivers", ("Username",), [(name,) for name in caregivers])
+            insert_rows(cursor, "Vaccines", ("Name", "Doses", "Version"),
+                        [(name, doses, 0) for name, doses in (vaccines or {}).items()])
+            insert_rows(cursor, "Availabilities", ("Time", "Username", "Slots"),
+                        [(date, caregiver, slots) for (date, caregiver), slots in (availabilities or {}).items()])
+            conn.commit()
+
+    def query(self, sql, params=()):
+        with ConnectionManager() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            return [tuple(row) for row in cursor.fetchall()]
+
+    def doses(self, name):
+        return self.query("SELECT Doses FROM Vaccines WHERE Name = %s", (name,))[0][0]
+
+    def patient_session(self, username):
+        # a session logged in as username without a password check
+        session = SchedulerSession()
+        session.patient = Patient(username)
+        return session
+
+    def caregiver_session(self, username):
+        session = SchedulerSession()
+        session.caregiver = Caregiver(username)
+        return session
+
+    def assert_consistent(self):
+        # no slot is booked twice or still offered once booked
+        double_booked = self.query("SELECT c_username, Time, Slot FROM Appointments "
+                                   "GROUP BY c_username, Time, Slot HAVING COUNT(*) > 1")
+        self.assertEqual(double_booked, [])
+        still_free = self.query("SELECT a.AppID FROM Appointments a JOIN Availabilities v "
+                                "ON v.Username = a.c_username AND v.Time = a.Time "
+                                "WHERE v.Slots & (1 << a.Slot) <> 0")
+        self.assertEqual(still_free, [])
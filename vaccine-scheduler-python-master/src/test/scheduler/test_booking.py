@@ -0,0 +1,153 @@
+import os
+import threading
+import unittest
+from unittest import mock
+
+from support import DatabaseTestCase, day, format_date
+
+from db.ConnectionManager import ConnectionManager
+from service.BookingEngine import BookingEngine, BookingResult
+from service.CancellationEngine import CancellationEngine
+from service.ReservationCoordinator import ReservationCoordinator
+from service.SchedulerSession import CommandResult
+
+
+def run_threads(work, items, threads):
+    # calls work(item) for every item from threads threads, returns the results in order;
+    # an exception is returned in place of its result
+    results = [None] * len(items)
+
+    def worker(offset):
+        for i in range(offset, len(items), threads):
+            try:
+                results[i] = work(items[i])
+            except BaseException as e:
+                results[i] = e
+
+    workers = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join(60)
+    if any(t.is_alive() for t in workers):
+        raise AssertionError("Threads still running after 60 seconds")
+    return results
+
+
+class ReserveManyTest(DatabaseTestCase):
+    def test_books_in_order_until_the_doses_run_out(self):
+        self.seed(patients=["p%d" % i for i in range(5)], caregivers=["c0", "c1"],
+                  availabilities={(day(0), "c0"): 0b11, (day(0), "c1"): 0b11}, vaccines={"pfizer": 3})
+        results = BookingEngine().reserve_many([("p%d" % i, day(0), "pfizer") for i in range(5)])
+        self.assertEqual([result.status for result in results],
+                         [BookingResult.BOOKED] * 3 + [BookingResult.NO_DOSES] * 2)
+        self.assertEqual(self.doses("pfizer"), 0)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM Appointments"), [(3,)])
+        self.assert_consistent()
+
+    def test_takes_every_slot_then_reports_no_caregiver(self):
+        self.seed(patients=["p0", "p1", "p2", "p3"], caregivers=["c0"],
+                  availabilities={(day(0), "c0"): 0b111}, vaccines={"pfizer": 10})
+        results = BookingEngine().reserve_many([("p%d" % i, day(0), "pfizer") for i in range(4)])
+        self.assertEqual([result.get_slot() for result in results[:3]], [0, 1, 2])
+        self.assertEqual(results[3].status, BookingResult.NO_CAREGIVER)
+        # a caregiver's row goes once no slot is left
+        self.assertEqual(self.query("SELECT * FROM Availabilities"), [])
+        self.assertEqual(self.doses("pfizer"), 7)
+
+    def test_unknown_vaccine_and_day_without_caregivers(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 1}, vaccines={"pfizer": 1})
+        results = BookingEngine().reserve_many([("p0", day(0), "moderna"), ("p0", day(1), "pfizer")])
+        self.assertEqual([result.status for result in results], [BookingResult.NO_VACCINE, BookingResult.NO_CAREGIVER])
+        self.assertEqual(self.doses("pfizer"), 1)
+
+    def test_cancel_gives_back_the_slot_and_the_dose(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 0b11}, vaccines={"pfizer": 2})
+        first, second = BookingEngine().reserve_many([("p0", day(0), "pfizer"), ("p0", day(0), "pfizer")])
+        CancellationEngine().cancel([first.get_appointment_id()], patient_username="p0")
+        self.assertEqual(self.query("SELECT Slots FROM Availabilities"), [(0b01,)])
+        self.assertEqual(self.doses("pfizer"), 1)
+        CancellationEngine().cancel([second.get_appointment_id()], patient_username="p0")
+        self.assertEqual(self.query("SELECT Slots FROM Availabilities"), [(0b11,)])
+        self.assertEqual(self.doses("pfizer"), 2)
+
+
+class ConcurrentReserveTest(DatabaseTestCase):
+    DAYS = 5
+    CAREGIVERS = 10
+    SLOTS = 0b1111
+    DOSES = 150
+
+    def test_no_double_booking_and_exact_doses(self):
+        # more patients than slots and doses, reserving from many sessions at once
+        patients = ["p%d" % i for i in range(400)]
+        caregivers = ["c%d" % i for i in range(self.CAREGIVERS)]
+        commands = [(patient, ["reserve", format_date(day(i % self.DAYS)), "pfizer"])
+                    for i, patient in enumerate(patients)]
+        for window in ("0", "5"):
+            with self.subTest(ReserveBatchWindow=window), mock.patch.dict(os.environ, {"ReserveBatchWindow": window}):
+                with ConnectionManager() as conn:
+                    for table in ("Appointments", "Waitlist", "Availabilities", "Vaccines", "Caregivers", "Patients"):
+                        conn.cursor().execute("DELETE FROM " + table)
+                    conn.commit()
+                self.use_pool()
+                self.seed(patients=patients, caregivers=caregivers, vaccines={"pfizer": self.DOSES},
+                          availabilities={(day(d), c): self.SLOTS for d in range(self.DAYS) for c in caregivers})
+                results = run_threads(lambda command: self.patient_session(command[0]).execute(command[1]),
+                                      commands, 32)
+                for result in results:
+                    self.assertIsInstance(result, CommandResult)
+                booked = sum(1 for result in results if result.is_ok())
+                self.assertEqual(booked, self.DOSES)
+                self.assertEqual(self.query("SELECT COUNT(*), COUNT(DISTINCT p_username) FROM Appointments"),
+                                 [(self.DOSES, self.DOSES)])
+                self.assertEqual(self.doses("pfizer"), 0)
+                self.assert_consistent()
+
+
+class PoolExhaustionTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.dict(os.environ, {"PoolSize": "2", "PoolCheckoutTimeout": "0.5"})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.use_pool()
+
+    def test_sessions_answer_when_the_pool_runs_dry(self):
+        # every reservation fails for want of doses and joins the waitlist on a second connection
+        patients = ["p%d" % i for i in range(32)]
+        self.seed(patients=patients, caregivers=["c0"], availabilities={(day(0), "c0"): 1}, vaccines={"pfizer": 0})
+        results = run_threads(lambda patient: self.patient_session(patient).execute(
+            ["reserve", format_date(day(0)), "pfizer"]), patients, 32)
+        for result in results:
+            self.assertIsInstance(result, CommandResult)
+            self.assertFalse(result.fatal)
+
+    def test_pool_timeouts_are_not_fatal(self):
+        self.seed(patients=["p0"])
+        pool = ConnectionManager.get_pool()
+        held = [pool.checkout() for _ in range(pool.max_size)]
+        try:
+            result = self.patient_session(None).execute(["login_patient", "p0", "Passw0rd!"])
+        finally:
+            for conn in held:
+                pool.checkin(conn)
+        self.assertFalse(result.is_ok())
+        self.assertFalse(result.fatal)
+
+    def test_reservation_writer_recovers(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 1}, vaccines={"pfizer": 1})
+        coordinator = ReservationCoordinator(window=0.005, size=10, timeout=10)
+        pool = ConnectionManager.get_pool()
+        held = [pool.checkout() for _ in range(pool.max_size)]
+        try:
+            with self.assertRaises(Exception):
+                coordinator.reserve("p0", day(0), "pfizer")
+        finally:
+            for conn in held:
+                pool.checkin(conn)
+        self.assertTrue(coordinator.reserve("p0", day(0), "pfizer").is_booked())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+import io
+import json
+import unittest
+
+from support import DatabaseTestCase, day, format_date
+
+from service.ScriptRunner import ScriptRunner
+
+
+class ScriptRunnerTest(DatabaseTestCase):
+    def run_script(self, session, lines, batch_size=1000):
+        # returns the entries written for the commands and the summary
+        out = io.StringIO()
+        ScriptRunner(session, out, batch_size).run(lines)
+        entries = [json.loads(line) for line in out.getvalue().splitlines()]
+        return entries[:-1], entries[-1]["summary"]
+
+    def test_reserve_lines_are_booked_in_order(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 0b111}, vaccines={"pfizer": 2})
+        reserve = "reserve %s pfizer" % format_date(day(0))
+        entries, summary = self.run_script(self.patient_session("p0"),
+                                           [reserve, "reserve 13-40-2030 pfizer", reserve, reserve])
+        self.assertEqual([entry["line"] for entry in entries], [1, 2, 3, 4])
+        self.assertEqual([entry["ok"] for entry in entries], [True, False, True, False])
+        self.assertEqual([entry["data"]["slot"] for entry in (entries[0], entries[2])], [0, 1])
+        self.assertEqual(entries[3]["lines"][0], "Not enough available doses!")
+        self.assertEqual(summary, {"commands": 4, "ok": 2, "failed": 2})
+        self.assert_consistent()
+
+    def test_runs_are_cut_at_batch_size_and_other_commands(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 0b1111}, vaccines={"pfizer": 4})
+        reserve = "reserve %s pfizer" % format_date(day(0))
+        entries, summary = self.run_script(self.patient_session("p0"),
+                                           [reserve, reserve, reserve, "show_appointments", reserve], batch_size=2)
+        self.assertEqual([entry["command"] for entry in entries], ["reserve"] * 3 + ["show_appointments", "reserve"])
+        self.assertEqual(entries[3]["data"]["count"], 3)
+        self.assertEqual(summary["failed"], 0)
+        self.assertEqual(self.doses("pfizer"), 0)
+
+    def test_repeated_upload_date_fails(self):
+        self.seed(caregivers=["c0"])
+        first, second = format_date(day(0)), format_date(day(1))
+        entries, summary = self.run_script(self.caregiver_session("c0"), [
+            "upload_availability %s --slots 2" % first,
+            "upload_availability %s --slots 4" % first,
+            "upload_availability %s" % second,
+        ])
+        self.assertEqual([entry["ok"] for entry in entries], [True, False, True])
+        self.assertEqual(self.query("SELECT Time, Slots FROM Availabilities ORDER BY Time"),
+                         [(day(0), 0b11), (day(1), 0b1)])
+        # a date uploaded by an earlier run fails too
+        entries, summary = self.run_script(self.caregiver_session("c0"), ["upload_availability %s" % second])
+        self.assertFalse(entries[0]["ok"])
+
+    def test_add_doses_lines_are_added_up(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 1}, vaccines={"pfizer": 0})
+        self.patient_session("p0").execute(["reserve", format_date(day(0)), "pfizer"])
+        entries, summary = self.run_script(self.caregiver_session("c0"),
+                                           ["add_doses pfizer 2", "add_doses pfizer -1", "add_doses moderna 3",
+                                            "add_doses pfizer 1"])
+        self.assertEqual([entry["ok"] for entry in entries], [True, False, True, True])
+        # the waiting patient is booked once the run is written
+        self.assertEqual(len(entries[3]["data"]["waitlist_booked"]), 1)
+        self.assertEqual(self.doses("pfizer"), 2)
+        self.assertEqual(self.doses("moderna"), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
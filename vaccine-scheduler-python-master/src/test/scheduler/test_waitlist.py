@@ -0,0 +1,105 @@
+import datetime
+import threading
+import unittest
+
+from support import DatabaseTestCase, day, format_date
+
+from db.ConnectionManager import ConnectionManager
+from service.WaitlistEngine import WaitlistEngine
+
+
+class WaitlistTest(DatabaseTestCase):
+    def reserve(self, patient, offset, vaccine="pfizer"):
+        return self.patient_session(patient).execute(["reserve", format_date(day(offset)), vaccine])
+
+    def add_doses(self, doses, vaccine="pfizer"):
+        return self.caregiver_session("c0").execute(["add_doses", vaccine, str(doses)])
+
+    def waiting(self):
+        return self.query("SELECT p_username, Time, Name FROM Waitlist ORDER BY WaitID")
+
+    def appointments(self):
+        return self.query("SELECT p_username, Time FROM Appointments ORDER BY AppID")
+
+    def test_books_oldest_first_when_doses_arrive(self):
+        self.seed(patients=["p0", "p1", "p2"], caregivers=["c0"], availabilities={(day(0), "c0"): 0b111},
+                  vaccines={"pfizer": 0})
+        positions = [self.reserve(patient, 0).get_data()["waitlist_position"] for patient in ("p0", "p1", "p2")]
+        self.assertEqual(positions, [1, 2, 3])
+
+        result = self.add_doses(2)
+        self.assertEqual(len(result.get_data()["waitlist_booked"]), 2)
+        self.assertEqual(self.appointments(), [("p0", day(0)), ("p1", day(0))])
+        self.assertEqual(self.waiting(), [("p2", day(0), "pfizer")])
+        self.assert_consistent()
+
+    def test_books_a_patient_once_per_vaccine(self):
+        # the patient waits for three days; the doses arrive for all of them at once
+        self.seed(patients=["p0", "p1"], caregivers=["c0"], vaccines={"pfizer": 0},
+                  availabilities={(day(d), "c0"): 0b11 for d in range(3)})
+        for offset in range(3):
+            self.reserve("p0", offset)
+        self.reserve("p1", 2)
+
+        self.add_doses(5)
+        self.assertEqual(self.appointments(), [("p0", day(0)), ("p1", day(2))])
+        self.assertEqual(self.waiting(), [])
+        self.assertEqual(self.doses("pfizer"), 3)
+
+    def test_cancelling_is_not_undone_by_the_waitlist(self):
+        self.seed(patients=["p0"], caregivers=["c0"], vaccines={"pfizer": 0},
+                  availabilities={(day(0), "c0"): 1, (day(1), "c0"): 1})
+        self.reserve("p0", 0)
+        self.reserve("p0", 1)
+        appointment_id = self.add_doses(1).get_data()["waitlist_booked"][0]
+
+        result = self.patient_session("p0").execute(["cancel", str(appointment_id)])
+        self.assertTrue(result.is_ok())
+        self.assertNotIn("waitlist_booked", result.get_data())
+        self.assertEqual(self.appointments(), [])
+        self.assertEqual(self.doses("pfizer"), 1)
+
+    def test_patient_with_an_appointment_does_not_wait(self):
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(day(0), "c0"): 1}, vaccines={"pfizer": 2})
+        self.assertTrue(self.reserve("p0", 0).is_ok())
+
+        # no caregiver that day
+        result = self.reserve("p0", 1)
+        self.assertFalse(result.is_ok())
+        self.assertIsNone(result.get_data())
+        self.assertEqual(self.waiting(), [])
+        # other vaccines are still waited for
+        self.seed(vaccines={"moderna": 0})
+        self.assertEqual(self.reserve("p0", 0, "moderna").get_data(), {"waitlist_position": 1})
+
+    def test_entries_are_unique(self):
+        self.seed(patients=["p0"], vaccines={"pfizer": 0})
+        results = []
+
+        def add():
+            results.append(WaitlistEngine().add("p0", day(0), "pfizer"))
+
+        threads = [threading.Thread(target=add) for _ in range(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(results, [1] * 16)
+        self.assertEqual(self.waiting(), [("p0", day(0), "pfizer")])
+
+    def test_match_drops_past_entries(self):
+        yesterday = datetime.date.today() - datetime.timedelta(days=1)
+        self.seed(patients=["p0"], caregivers=["c0"], availabilities={(yesterday, "c0"): 1}, vaccines={"pfizer": 0})
+        with ConnectionManager() as conn:
+            conn.cursor().execute("INSERT INTO Waitlist (WaitID, p_username, Time, Name) VALUES (%d, %s, %s, %s)",
+                                  (1, "p0", yesterday, "pfizer"))
+            conn.commit()
+
+        self.add_doses(1)
+        self.assertEqual(self.waiting(), [])
+        self.assertEqual(self.appointments(), [])
+        self.assertEqual(self.doses("pfizer"), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()